@@ -0,0 +1,94 @@
+"""Time laying out and drawing Graphs with many subplots.
+
+For each number of subplots a Graph of small line plots is laid out with
+`plot.subplots` and then rendered to a PNG, which is where the ticks of every
+subplot are calculated and drawn. Use `--no-share` to time graphs whose
+subplots don't share their axes and `--shards` to draw the PNG in several
+processes.
+"""
+import io
+import os
+import os.path
+import sys
+import math
+import time
+import argparse
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from uniplot import plot  # noqa: E402
+
+
+def graph(nsubplots, npoints, share):
+    """A Graph of nsubplots lines with npoints each."""
+    x = numpy.linspace(0, 10, npoints)
+    return plot.Graph({
+        'share': share,
+        'plots': [
+            {'axes': {'x': x, 'y': numpy.sin(x + i) * (i + 1)}}
+            for i in range(nsubplots)
+        ],
+    })
+
+
+def best_of(repeat, func):
+    """Best wall time of repeat calls to func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument(
+        '--subplots', nargs='+', type=int, default=[1, 16, 64, 100, 200, 400],
+        help='numbers of subplots to benchmark.',
+    )
+    arg_parser.add_argument(
+        '--points', type=int, default=100,
+        help='number of points in each subplot.',
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='take the best of this many runs.',
+    )
+    arg_parser.add_argument(
+        '--no-share', dest='share', action='store_false',
+        help="don't share the axes of the subplots.",
+    )
+    arg_parser.add_argument(
+        '--shards', type=int, metavar='N',
+        help='render in N processes, 0 for one per CPU core.',
+    )
+    args = arg_parser.parse_args()
+
+    print('{:>9} {:>10} {:>12} {:>10}'.format(
+        'subplots', 'layout', 'per subplot', 'render'
+    ))
+    for nsubs in args.subplots:
+        nrows = plot.round_half_up(math.sqrt(nsubs))
+        ncols = math.ceil(nsubs/nrows)
+
+        def layout():
+            plot.subplots(plot.new_figure(), nrows, ncols, nsubs, args.share)
+
+        data = graph(nsubs, args.points, args.share)
+
+        def render():
+            plot.render(data, io.BytesIO(), format='png', shards=args.shards)
+
+        layout_time = best_of(args.repeat, layout)
+        print('{:>9} {:>9.3f}s {:>10.2f}ms {:>9.3f}s'.format(
+            nsubs, layout_time, 1000 * layout_time / nsubs,
+            best_of(args.repeat, render),
+        ))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Compare the throughput of uniplot's column reader with numpy.loadtxt.
+
+Writes CSV and whitespace delimited files with the given numbers of rows and
+times reading a single column from each. Files with 10^8 rows are several
+gigabytes so they are not included by default, use `--rows 1e5 1e6 1e7 1e8`.
+
+On NumPy 1.23 onwards the reader hands whole files to loadtxt's C parser, so
+the two should be level. Use `--chunked` to time the chunked parser which is
+used on older versions of NumPy.
+"""
+import os
+import os.path
+import sys
+import time
+import argparse
+import tempfile
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from uniplot import data  # noqa: E402
+
+
+NCOLS = 4
+
+
+def write_file(path, nrows, delimiter):
+    """Write nrows of random data in chunks to keep memory bounded."""
+    rng = numpy.random.default_rng(0)
+    with open(path, 'w') as f:
+        f.write(delimiter.join('c{}'.format(i) for i in range(NCOLS)) + '\n')
+        for start in range(0, nrows, 10**6):
+            rows = rng.random((min(10**6, nrows - start), NCOLS))
+            numpy.savetxt(f, rows, delimiter=delimiter, fmt='%.8g')
+
+
+def best_of(repeat, func):
+    """Best wall time of repeat calls to func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    """Run the benchmark and print a table of results."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument(
+        '--rows', nargs='+', type=float, default=[1e5, 1e6, 1e7],
+        help='numbers of rows to benchmark.',
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='take the best of this many runs.',
+    )
+    arg_parser.add_argument(
+        '--skip-loadtxt-above', type=float, default=1e7,
+        help="don't time loadtxt on files with more rows than this.",
+    )
+    arg_parser.add_argument(
+        '--chunked', action='store_true',
+        help='always use the chunked parser used on older NumPy versions.',
+    )
+    args = arg_parser.parse_args()
+    if args.chunked:
+        data._C_LOADTXT = False
+
+    print('{:>10} {:>4} {:>9} {:>12} {:>12} {:>12}'.format(
+        'rows', 'fmt', 'MB', 'loadtxt MB/s', 'reader MB/s', 'speedup'
+    ))
+    with tempfile.TemporaryDirectory() as tmp:
+        for nrows in map(int, args.rows):
+            for (ext, delimiter) in (('.csv', ','), ('.dat', ' ')):
+                path = os.path.join(tmp, 'bench' + ext)
+                write_file(path, nrows, delimiter)
+                size = os.path.getsize(path) / 1024**2
+                ref = data.ColumnReference(path, 1, 1)
+
+                reader = best_of(args.repeat, lambda: data.read_columns(
+                    path, [ref.column], ref.skiprows, ref.delimiter
+                ))
+                if nrows <= args.skip_loadtxt_above:
+                    loadtxt = best_of(args.repeat, lambda: numpy.loadtxt(
+                        path, delimiter=ref.delimiter, usecols=[ref.column],
+                        skiprows=ref.skiprows,
+                    ))
+                    speedup = '{:.2f}x'.format(loadtxt / reader)
+                    loadtxt = '{:.1f}'.format(size / loadtxt)
+                else:
+                    loadtxt = speedup = '-'
+
+                print('{:>10} {:>4} {:>9.1f} {:>12} {:>12.1f} {:>12}'.format(
+                    nrows, ext[1:], size, loadtxt, size / reader, speedup
+                ))
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
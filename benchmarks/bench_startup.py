@@ -0,0 +1,96 @@
+"""Check that the uniplot CLI starts up within a time budget.
+
+Times `uniplot --version` and `uniplot --help` in fresh interpreters, subtracts
+the time taken to start a bare interpreter, and exits with a non-zero status if
+either takes longer than the budget or imports any of the heavy modules which
+should only be imported once a file is actually plotted.
+"""
+import os
+import os.path
+import sys
+import time
+import argparse
+import subprocess
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# modules which neither command needs
+HEAVY = ['numpy', 'matplotlib', 'matplotlib.pyplot', 'yaml', 'pytoml', 'hippy']
+
+COMMANDS = [['--version'], ['--help']]
+
+# runs the CLI then reports which heavy modules it imported
+SCRIPT = '''
+import sys
+from uniplot.cli import main
+try:
+    main()
+except SystemExit:
+    pass
+print(' '.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+'''
+
+
+def run(args):
+    """Time a fresh interpreter running args, returning seconds and stderr."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable] + args, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def best_of(repeat, args):
+    """Best wall time, and the last stderr, of repeat runs of args."""
+    times = []
+    for _ in range(repeat):
+        seconds, stderr = run(args)
+        times.append(seconds)
+
+    return min(times), stderr
+
+
+def main():
+    """Run the benchmark, exiting with 1 if it is over budget."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument(
+        '--budget', type=float, default=100,
+        help='milliseconds allowed on top of interpreter start-up '
+        '(default: %(default)d).',
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='take the best of this many runs.',
+    )
+    args = arg_parser.parse_args()
+
+    bare, _ = best_of(args.repeat, ['-c', 'pass'])
+    print('interpreter: {:.1f} ms'.format(bare * 1000))
+
+    failed = False
+    for command in COMMANDS:
+        seconds, stderr = best_of(args.repeat, [
+            '-c', SCRIPT.format(heavy=HEAVY)
+        ] + command)
+        overhead = (seconds - bare) * 1000
+        imported = stderr.split()
+
+        status = 'ok'
+        if overhead > args.budget:
+            status = 'over budget'
+        elif imported:
+            status = 'imported ' + ', '.join(imported)
+        failed = failed or status != 'ok'
+
+        print('uniplot {}: {:.1f} ms ({})'.format(
+            ' '.join(command), overhead, status
+        ))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
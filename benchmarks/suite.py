@@ -0,0 +1,307 @@
+"""Benchmark parsing, data loading, plotting and saving at a range of scales.
+
+Synthetic Hip, YAML and TOML plot files, Multi-Spect spectra and data files
+are generated in a temporary directory, then each stage is timed separately:
+
+    parse/FORMAT     reading a plot file with inline values
+    multispect       reading a Multi-Spect spectrum
+    axes             converting inline values in `plot.Axes`
+    load/FORMAT      reading the columns of a data file
+    plot             `Graph.plot`, including the layout of the subplots
+    savefig/FORMAT   saving a plotted figure with each backend
+
+Results are written as JSON with `--output`. Given a previous results file
+with `--compare`, every benchmark which has slowed down by more than the
+tolerance is reported and the exit status is 1, so a release can be checked
+against the last one:
+
+    python benchmarks/suite.py --output before.json
+    ... make changes ...
+    python benchmarks/suite.py --output after.json --compare before.json
+
+The defaults finish in a few minutes. Larger scales are given explicitly, for
+example `--points 1e3 1e5 1e7 1e8 --subplots 1 20 400`. Inline plot files are
+limited by `--max-inline` and plots by `--max-total` points in total, since
+beyond those sizes they would take hours without telling us anything new.
+"""
+import io
+import os
+import os.path
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import tempfile
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import matplotlib  # noqa: E402
+from uniplot import parse, plot  # noqa: E402
+from uniplot.data import DataFileLoader  # noqa: E402
+from uniplot.parse.multispect import MultiSpectParser  # noqa: E402
+from uniplot.__about__ import __version__  # noqa: E402
+
+
+SPEC_FORMATS = ['hip', 'yaml', 'toml']
+DATA_FORMATS = ['csv', 'dat', 'npy']
+SAVE_FORMATS = ['png', 'pdf', 'svg']
+
+
+def series(npoints, seed=0):
+    """A sorted x and a noisy y with npoints values."""
+    rng = numpy.random.default_rng(seed)
+    x = numpy.linspace(0, 100, npoints)
+    return x, numpy.sin(x) + rng.normal(scale=0.1, size=npoints)
+
+
+def graph_data(nsubplots, nseries, npoints, lists=False):
+    """The dict of a Graph with nsubplots of nseries of npoints each."""
+    plots = []
+    for i in range(nsubplots):
+        axes = []
+        for j in range(nseries):
+            x, y = series(npoints, seed=i*nseries + j)
+            if lists:
+                x, y = x.tolist(), y.tolist()
+            axes.append({'x': x, 'y': y, 'legend': 'series {}'.format(j)})
+        plots.append({'title': 'plot {}'.format(i), 'axes': axes})
+
+    return {'title': 'benchmark', 'plots': plots}
+
+
+def write_spec(path, fmt, data):
+    """Write a plot file in one of SPEC_FORMATS."""
+    if fmt == 'hip':
+        import hippy
+        hippy.write(path, data)
+    elif fmt == 'yaml':
+        import yaml
+        with open(path, 'w') as f:
+            yaml.dump(data, f, Dumper=getattr(yaml, 'CDumper', yaml.Dumper))
+    elif fmt == 'toml':
+        import pytoml
+        with open(path, 'w') as f:
+            pytoml.dump(data, f)
+
+
+def write_multispect(path, nchannels):
+    """Write a calibrated Multi-Spect spectrum with nchannels channels."""
+    counts = numpy.random.default_rng(0).poisson(100, size=nchannels)
+    with open(path, 'w') as f:
+        f.write('$SPEC_REM:\nMulti-Spect\n$DATE_MEA:\n01/23/2015 16:48:21\n')
+        f.write('$MEAS_TIM:\n600.0 614.0\n$DATA:\n0 {}\n'.format(nchannels - 1))
+        numpy.savetxt(f, counts, fmt='%d')
+        f.write('$ENER_FIT:\n0.73 0.74\n')
+
+
+def write_data(path, fmt, npoints):
+    """Write two columns of npoints rows, in chunks to bound memory."""
+    if fmt == 'npy':
+        numpy.save(path, numpy.column_stack(series(npoints)))
+        return
+
+    delimiter = ',' if fmt == 'csv' else ' '
+    with open(path, 'w') as f:
+        for start in range(0, npoints, 10**6):
+            stop = min(start + 10**6, npoints)
+            x = numpy.arange(start, stop, dtype=float)
+            numpy.savetxt(
+                f, numpy.column_stack([x, numpy.sin(x)]),
+                delimiter=delimiter, fmt='%.8g',
+            )
+
+
+def benchmarks(args, tmp):
+    """Yield (name, setup) pairs, setup returns the function to time."""
+    for npoints in args.points:
+        if npoints <= args.max_inline:
+            for fmt in SPEC_FORMATS:
+                def setup(fmt=fmt, npoints=npoints):
+                    path = os.path.join(tmp, 'spec.' + fmt)
+                    write_spec(path, fmt, graph_data(1, 1, npoints, True))
+                    return lambda: parse.load_parser(path, fmt)
+                yield 'parse/{}/points={}'.format(fmt, npoints), setup
+
+            def setup(npoints=npoints):
+                data = graph_data(1, 1, npoints, True)['plots'][0]['axes'][0]
+                return lambda: plot.Axes(data)
+            yield 'axes/points={}'.format(npoints), setup
+
+        def setup(npoints=npoints):
+            path = os.path.join(tmp, 'spectrum.spe')
+            write_multispect(path, npoints)
+
+            def run():
+                parser = MultiSpectParser(path)
+                parser.isfiletype()
+                parser.parse()
+            return run
+        yield 'multispect/channels={}'.format(npoints), setup
+
+        for fmt in DATA_FORMATS:
+            def setup(fmt=fmt, npoints=npoints):
+                path = os.path.join(tmp, 'data.' + fmt)
+                write_data(path, fmt, npoints)
+                spec = {'x': path + ':0', 'y': path + ':1'}
+                return lambda: plot.Graph(spec, DataFileLoader())
+            yield 'load/{}/points={}'.format(fmt, npoints), setup
+
+    for nsubplots in args.subplots:
+        for nseries in args.series:
+            for npoints in args.points:
+                if nsubplots * nseries * npoints > args.max_total:
+                    continue
+                scale = 'subplots={}/series={}/points={}'.format(
+                    nsubplots, nseries, npoints
+                )
+
+                def setup(scale=(nsubplots, nseries, npoints)):
+                    graph = plot.Graph(graph_data(*scale))
+
+                    def run():
+                        figure = plot.new_figure()
+                        graph.plot(figure)
+                    return run
+                yield 'plot/' + scale, setup
+
+                for fmt in SAVE_FORMATS:
+                    def setup(fmt=fmt, scale=(nsubplots, nseries, npoints)):
+                        figure = plot.new_figure()
+                        plot.Graph(graph_data(*scale)).plot(figure)
+                        return lambda: figure.savefig(io.BytesIO(), format=fmt)
+                    yield 'savefig/{}/'.format(fmt) + scale, setup
+
+
+def best_of(repeat, func):
+    """Best wall time of repeat calls to func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def environment():
+    """Describe what the benchmarks were run with."""
+    return {
+        'uniplot': __version__,
+        'numpy': numpy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, tolerance, noise):
+    """Print the change in each result, returning the names of regressions."""
+    regressions = []
+    print('\n{:<55} {:>10} {:>10} {:>8}'.format(
+        'benchmark', 'before', 'after', 'change'
+    ))
+    for (name, seconds) in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        before = baseline[name]
+        ratio = seconds / before if before > 0 else float('inf')
+        slower = ratio > 1 + tolerance and seconds - before > noise
+        if slower:
+            regressions.append(name)
+        print('{:<55} {:>9.4f}s {:>9.4f}s {:>7.2f}x{}'.format(
+            name, before, seconds, ratio, ' !' if slower else ''
+        ))
+
+    return regressions
+
+
+def main():
+    """Run the benchmarks then save and compare the results."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument(
+        '--points', nargs='+', type=float, default=[1e3, 1e4, 1e5],
+        help='numbers of points per series.',
+    )
+    arg_parser.add_argument(
+        '--series', nargs='+', type=int, default=[1, 10],
+        help='numbers of series per subplot.',
+    )
+    arg_parser.add_argument(
+        '--subplots', nargs='+', type=int, default=[1, 16, 100],
+        help='numbers of subplots per graph.',
+    )
+    arg_parser.add_argument(
+        '--max-inline', type=float, default=1e5,
+        help='largest number of points written inline in a plot file.',
+    )
+    arg_parser.add_argument(
+        '--max-total', type=float, default=1e6,
+        help='largest number of points in a plotted graph.',
+    )
+    arg_parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='take the best of this many runs.',
+    )
+    arg_parser.add_argument(
+        '--filter', default='*',
+        help='only run benchmarks whose names match this glob.',
+    )
+    arg_parser.add_argument(
+        '--output',
+        help='save the results to this JSON file.',
+    )
+    arg_parser.add_argument(
+        '--compare', metavar='BASELINE',
+        help='compare the results with those saved in BASELINE.',
+    )
+    arg_parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='fraction by which a benchmark may slow down (default: 0.2).',
+    )
+    arg_parser.add_argument(
+        '--noise', type=float, default=0.005,
+        help='ignore slow downs of fewer seconds than this (default: 0.005).',
+    )
+    args = arg_parser.parse_args()
+    args.points = [int(n) for n in args.points]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for (name, setup) in benchmarks(args, tmp):
+            if not fnmatch.fnmatch(name, args.filter):
+                continue
+
+            try:
+                results[name] = best_of(args.repeat, setup())
+            except (Exception, SystemExit) as e:
+                # e.g. an optional parser which isn't installed
+                print('{:<55} failed: {!r}'.format(name, e))
+                continue
+            finally:
+                sys.stdout.flush()
+            print('{:<55} {:>9.4f}s'.format(name, results[name]))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {'environment': environment(), 'results': results},
+                f, indent=1, sort_keys=True,
+            )
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.noise)
+        if regressions:
+            print('\n{} benchmarks slowed down by more than {:.0%}'.format(
+                len(regressions), args.tolerance
+            ))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,7 +32,7 @@ setup(
     )],
     extras_require={
         'YAML': ['PyYAML'],
-        'TOML': ['PyTOML'],
+        'TOML': ['PyTOML; python_version < "3.11"'],
     },
     entry_points={
         'console_scripts': ['uniplot = uniplot.cli:main'],
@@ -41,6 +41,8 @@ setup(
             'yaml = uniplot.parse.yaml:YamlParser [YAML]',
             'toml = uniplot.parse.toml:TomlParser [TOML]',
             'multispect = uniplot.parse.multispect:MultiSpectParser',
+            'multispect-stack = '
+            'uniplot.parse.multispect:MultiSpectStackParser',
         ],
     },
 )
@@ -0,0 +1,41 @@
+"""Tests for rendering many files in batch mode."""
+import sys
+import pytest
+from uniplot import batch, cli
+
+
+def test_split_collisions():
+    """Only the first job to claim an output renders it."""
+    jobs = [
+        ('a.hip', ['out/a.pdf', 'out/a.png']),
+        ('b.hip', ['out/b.pdf']),
+        ('a.yml', ['out/a.png']),
+    ]
+
+    unique, collisions = batch.split_collisions(jobs)
+
+    assert unique == jobs[:2]
+    [(input_file, outputs, error, _, rendered)] = collisions
+    assert (input_file, outputs, rendered) == ('a.yml', ['out/a.png'], False)
+    assert 'a.hip' in error
+
+
+def test_colliding_outputs_fail(tmp_path, monkeypatch, capsys):
+    """Inputs with the same name in one output directory are failures."""
+    for directory in ('first', 'second'):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'a.yml').write_text('x: [1, 2]\ny: [3, 4]\n')
+    output_dir = tmp_path / 'out'
+
+    monkeypatch.setattr(sys, 'argv', [
+        'uniplot', '-b', str(tmp_path / '*' / 'a.yml'), '-o', str(output_dir),
+        '-f', 'png', '-j', '1', '--no-server',
+    ])
+    with pytest.raises(SystemExit) as exit:
+        cli.main()
+
+    assert exit.value.code == 1
+    assert [p.name for p in output_dir.iterdir()] == ['a.png']
+    err = capsys.readouterr().err
+    assert 'is also rendered from' in err
+    assert 'rendered 1 of 2 files' in err
@@ -0,0 +1,36 @@
+"""Tests for skipping outputs which are up to date."""
+import os
+import numpy
+from uniplot import build, cli, parse
+
+
+def test_current_outputs_are_not_parsed(tmp_path, monkeypatch):
+    """Up to date outputs are skipped before the plot file is parsed."""
+    data_file = tmp_path / 'data.dat'
+    numpy.savetxt(str(data_file), [[1, 2], [3, 4]])
+    spec = tmp_path / 'graph.yml'
+    spec.write_text('x: "{0}:0"\ny: "{0}:1"\n'.format(data_file))
+    output = str(tmp_path / 'graph.png')
+    manifest = build.Manifest(str(tmp_path / 'manifest'))
+
+    assert cli.render_file(str(spec), output, 'yaml', manifest=manifest)
+
+    parse_file = parse.parse_file
+    parsed = []
+    monkeypatch.setattr(parse, 'parse_file', lambda *args, **kwargs: (
+        parsed.append(args[0]) or parse_file(*args, **kwargs)
+    ))
+
+    assert not cli.render_file(str(spec), output, 'yaml', manifest=manifest)
+    assert parsed == []
+
+    # a data file only known from parsing still invalidates the output
+    stat = os.stat(str(data_file))
+    os.utime(str(data_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cli.render_file(str(spec), output, 'yaml', manifest=manifest)
+    assert parsed == [str(spec)]
+
+    # as do different options
+    assert cli.render_file(
+        str(spec), output, 'yaml', decimation='minmax', manifest=manifest
+    )
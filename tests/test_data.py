@@ -0,0 +1,32 @@
+"""Tests for reading data files."""
+import numpy
+from uniplot import data
+
+
+def histogram(filename, bins, limits=None):
+    """Reference the counts of a histogram of the first column of a file."""
+    spec = {'histogram': '{}:0'.format(filename), 'bins': bins}
+    if limits is not None:
+        spec['range'] = limits
+    return data.HistogramReference.from_spec(spec)
+
+
+def test_bin_edges_need_no_limits(tmp_path, monkeypatch):
+    """Only a number of bins without a range reads the file for its limits."""
+    filename = str(tmp_path / 'events.dat')
+    numpy.savetxt(filename, [0.5, 1.5, 1.7, 2.5, 9])
+
+    def find_limits(sources):
+        raise AssertionError('limits found for {}'.format(sources))
+
+    monkeypatch.setattr(data, 'find_limits', find_limits)
+    edges = histogram(filename, [0, 1, 2, 3])
+    bounded = histogram(filename, 2, [0, 2])
+    counts = data.HistogramReference.read([edges, bounded])
+
+    assert list(counts[0]) == [1, 2, 1]
+    assert list(counts[1]) == [1, 2]
+
+    monkeypatch.undo()
+    [counts] = data.HistogramReference.read([histogram(filename, 2)])
+    assert list(counts) == [4, 1]
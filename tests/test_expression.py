@@ -0,0 +1,73 @@
+"""Tests for axes calculated from the columns of data files."""
+import numpy
+import pytest
+from uniplot import plot
+from uniplot.data import DataFileLoader, ExpressionReference
+from uniplot.expression import Expression
+
+
+def test_expressions_are_equal_by_value():
+    """Expressions which only differ in spacing are the same key."""
+    assert Expression('col1/col0') == Expression('col1 / col0')
+    assert hash(Expression('col1/col0')) == hash(Expression('col1 / col0'))
+    assert Expression('col1/col0') != Expression('col0/col1')
+
+
+def test_reparsing_reuses_expressions(tmp_path):
+    """Requesting an expression again doesn't calculate another column."""
+    data = tmp_path / 'data.dat'
+    numpy.savetxt(str(data), [[1, 2], [3, 4]])
+    spec = {'expression': 'col1/col0', 'file': str(data)}
+    loader = DataFileLoader(threads=1)
+
+    for _ in range(3):
+        ref = loader.request(ExpressionReference.from_spec(dict(spec)))
+        loader.load()
+
+    calculated = [
+        r for r in loader._columns if isinstance(r, ExpressionReference)
+    ]
+    assert calculated == [ref]
+    numpy.testing.assert_allclose(loader.get(ref), [2, 4/3])
+
+    loader.forget_expressions()
+    assert not any(isinstance(r, ExpressionReference) for r in loader._columns)
+
+
+def test_expression_errors(tmp_path):
+    """Errors of calculated axes are given like those of any other."""
+    data = tmp_path / 'data.dat'
+    numpy.savetxt(str(data), [[1, 2], [3, 4]])
+    y = {'expression': 'col1', 'file': str(data)}
+
+    percentage = plot.Axes({'x': [0, 1], 'y': dict(y, errors=0.5)})
+    calculated = plot.Axes({'x': [0, 1], 'y': dict(y, errors={
+        'expression': 'col0', 'file': str(data),
+    })})
+
+    numpy.testing.assert_allclose(percentage.yerr, [1, 2])
+    numpy.testing.assert_allclose(calculated.yerr, [1, 3])
+
+
+@pytest.mark.parametrize('text', [
+    'sqrt(col0, col1)', 'round(col0, 2, col1)', 'minimum(col0, col1, col1)',
+    'arctan2(col0)', 'abs()',
+])
+def test_wrong_number_of_arguments(text):
+    """Functions can't be given an array to write their result into."""
+    with pytest.raises(ValueError, match='argument'):
+        Expression(text)
+
+
+def test_function_arguments():
+    """Each function is called with as many arguments as it takes."""
+    columns = {0: numpy.array([1.234, 4.0]), 1: numpy.array([3.0, 3.0])}
+
+    numpy.testing.assert_allclose(
+        Expression('round(col0, 1)')(columns), [1.2, 4.0]
+    )
+    numpy.testing.assert_allclose(Expression('round(col0)')(columns), [1, 4])
+    numpy.testing.assert_allclose(
+        Expression('minimum(col0, col1)')(columns), [1.234, 3.0]
+    )
+    numpy.testing.assert_allclose(columns[1], [3.0, 3.0])
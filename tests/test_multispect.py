@@ -0,0 +1,94 @@
+"""Tests for stacking Multi-Spect spectra into an image."""
+import gc
+import numpy
+import warnings
+import multiprocessing
+from uniplot import plot
+from uniplot.parse.multispect import MultiSpectStackParser, permute_rows
+
+
+def write_spectrum(path, date, counts):
+    """Write an uncalibrated spectrum measured for 10 seconds."""
+    with open(path, 'w') as f:
+        f.write('$SPEC_REM:\nMulti-Spect\n$DATE_MEA:\n{}\n'.format(date))
+        f.write('$MEAS_TIM:\n10.0 10.0\n$DATA:\n')
+        f.write('0 {}\n'.format(len(counts) - 1))
+        f.write(''.join('{}\n'.format(c) for c in counts))
+
+
+def test_permute_rows():
+    """Rows are moved in place, following each cycle of the permutation."""
+    array = numpy.arange(12.0).reshape(6, 2)
+    order = numpy.array([3, 0, 1, 2, 5, 4])
+    expected = array[order]
+
+    permute_rows(array, order)
+
+    numpy.testing.assert_array_equal(array, expected)
+
+
+def test_stack_is_sorted_by_date(tmp_path):
+    """File names out of date order and gaps give the right time axis."""
+    spectra = [
+        ('a.spe', '01/23/2015 13:00:00', [30, 30, 30]),
+        ('b.spe', '01/23/2015 12:00:00', [10, 10, 10]),
+        ('c.spe', '01/23/2015 12:30:00', [20, 20, 20]),
+    ]
+    for (name, date, counts) in spectra:
+        write_spectrum(str(tmp_path / name), date, counts)
+
+    data = MultiSpectStackParser(str(tmp_path)).parse()
+
+    [axes] = data['axes']
+    numpy.testing.assert_allclose(axes['y'], [0, 0.5, 1])
+    numpy.testing.assert_allclose(axes['z'][:, 0], [1, 2, 3])
+
+
+def test_finding_spectra_closes_them(tmp_path):
+    """Spectra are closed again once they are known to be spectra."""
+    for i in range(3):
+        write_spectrum(str(tmp_path / '{}.spe'.format(i)), '', [1, 2])
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        assert MultiSpectStackParser(str(tmp_path)).isfiletype()
+        gc.collect()
+
+    assert not [w for w in caught if w.category is ResourceWarning]
+
+
+def parse_stack(directory):
+    """Parse a stack, returning the shape of its image."""
+    [axes] = MultiSpectStackParser(directory).parse()['axes']
+    return axes['z'].shape
+
+
+def test_large_stack_in_daemonic_process(tmp_path):
+    """Workers which can't start processes read large stacks themselves."""
+    nspectra = MultiSpectStackParser.parallel_threshold + 6
+    for i in range(nspectra):
+        write_spectrum(
+            str(tmp_path / '{:03}.spe'.format(i)),
+            '01/23/2015 12:{:02}:00'.format(i % 60), [i, i, i],
+        )
+
+    with multiprocessing.Pool(1) as pool:
+        shape = pool.apply(parse_stack, (str(tmp_path),))
+
+    assert shape == (nspectra, 3)
+
+
+def test_uneven_rows_are_drawn_to_scale():
+    """Rows with a gap between them are drawn as a mesh, not an image."""
+    from matplotlib.collections import QuadMesh
+
+    graph = plot.Graph({
+        'x': [0, 1, 2], 'y': [0, 1, 5], 'z': numpy.ones((3, 3)),
+    })
+    figure = plot.new_figure()
+    graph.plot(figure)
+
+    [mesh] = figure.axes[0].collections
+    assert isinstance(mesh, QuadMesh)
+    assert figure.axes[0].get_ylim() == (-0.5, 7.0)
+    assert not figure.axes[0].images
@@ -0,0 +1,51 @@
+"""Tests for building and plotting Graphs."""
+import numpy
+from uniplot import cli, plot
+
+
+def errorbars(figure):
+    """The error bar containers drawn on each axes of a figure."""
+    from matplotlib.container import ErrorbarContainer
+
+    return [
+        [c for c in axis.containers if isinstance(c, ErrorbarContainer)]
+        for axis in figure.axes
+    ]
+
+
+def test_inline_percentage_errors_are_drawn(tmp_path):
+    """Percentage errors of inline values don't need any data files."""
+    spec = tmp_path / 'errors.yml'
+    spec.write_text(
+        'x: [1, 2, 3]\n'
+        'y:\n'
+        '  values: [10, 20, 30]\n'
+        '  errors: 0.1\n'
+    )
+
+    # as render_file does, without ever calling Graph.load
+    graph = cli.read_graph(str(spec), 'yaml')
+    graph.prefetch()
+    figure = plot.new_figure()
+    graph.plot(figure)
+
+    axis = graph.plots[0].axes[0]
+    numpy.testing.assert_allclose(axis.yerr, [1, 2, 3])
+    (container,) = errorbars(figure)[0]
+    assert container.has_yerr
+
+
+def test_render_file_with_calculated_axis(tmp_path):
+    """Graphs whose data is still being read can be rendered."""
+    numpy.savetxt(str(tmp_path / 'data.dat'), [[1, 2], [3, 4]])
+    spec = tmp_path / 'ratio.yml'
+    spec.write_text(
+        'x: "{0}:0"\n'
+        'y: {{expression: "col1/col0", file: "{0}"}}\n'.format(
+            tmp_path / 'data.dat'
+        )
+    )
+    output = tmp_path / 'ratio.png'
+
+    assert cli.render_file(str(spec), str(output), 'yaml')
+    assert output.stat().st_size > 0
@@ -0,0 +1,42 @@
+"""Tests for profiling renders."""
+import os
+from uniplot import cli, profile
+
+
+def write_graph(directory):
+    """Write a plot file with a legend, returning its name."""
+    directory.mkdir()
+    spec = directory / 'graph.yml'
+    spec.write_text('x: [1, 2, 3]\ny: [4, 5, 6]\nlegend: line\n')
+    return str(spec)
+
+
+def test_legend_is_timed_while_drawn(tmp_path):
+    """Placing the legend is timed when savefig draws it."""
+    runs = []
+    profiler = profile.Profiler(callback=runs.append)
+    spec = write_graph(tmp_path / 'graph')
+
+    cli.render_file(
+        spec, str(tmp_path / 'graph.png'), 'yaml', profiler=profiler
+    )
+
+    [run] = runs
+    names = [(r['name'], r['depth']) for r in run['stages']]
+    savefig = names.index(('savefig', 1))
+    assert names[savefig + 1] == ('legend', 2)
+
+
+def test_dumps_of_inputs_with_the_same_name(tmp_path):
+    """Inputs with the same name in different directories keep their dumps."""
+    dumps = tmp_path / 'dumps'
+    profiler = profile.Profiler(cprofile_dir=str(dumps))
+
+    for directory in ('first', 'second'):
+        spec = write_graph(tmp_path / directory)
+        cli.render_file(
+            spec, str(tmp_path / directory / 'graph.png'), 'yaml',
+            profiler=profiler,
+        )
+
+    assert len(os.listdir(str(dumps))) == 2
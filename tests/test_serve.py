@@ -0,0 +1,55 @@
+"""Tests for rendering through the server."""
+import time
+import threading
+import multiprocessing
+from uniplot import batch, cli, serve
+
+
+def sleep_job(job):
+    """Stand in for a render which takes as many seconds as its input."""
+    input_file, output_file, _ = job
+    time.sleep(float(input_file))
+    return (input_file, output_file, None, float(input_file), True)
+
+
+def test_only_running_jobs_time_out(tmp_path, monkeypatch):
+    """Jobs time out once they have run too long, not while queued."""
+    monkeypatch.setattr(batch, 'render_job', sleep_job)
+    monkeypatch.setattr(serve, 'JOB_TIMEOUT', 1)
+    path = str(tmp_path / 'serve.sock')
+    args = vars(cli.arg_setup().parse_args(['unused']))
+    jobs = ['0.3'] * 6 + ['5']
+
+    # workers are forked, so they share the patches
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        server = serve.Server(path, pool)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            responses = list(serve.request(serve.connect(path), [
+                {'input': seconds, 'args': args} for seconds in jobs
+            ]))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    errors = {r['id']: r['error'] for r in responses}
+    assert len(errors) == len(jobs)
+    assert [errors[i] for i in range(6)] == [None] * 6
+    assert errors[6].startswith('JobTimeout')
+
+
+def test_unanswered_jobs_fail(monkeypatch):
+    """Jobs the server never answers are failures."""
+    def request(sock, requests):
+        yield {'id': 1, 'output': ['b.png'], 'error': None, 'seconds': 0.5,
+               'rendered': True}
+
+    monkeypatch.setattr(serve, 'request', request)
+    jobs = [('a.yml', ['a.png']), ('b.yml', ['b.png'])]
+
+    results = cli.forward(None, jobs, {})
+
+    assert results[1] == ('b.yml', ['b.png'], None, 0.5, True)
+    (input_file, _, error, _, rendered) = results[0]
+    assert (input_file, rendered) == ('a.yml', False)
+    assert error is not None
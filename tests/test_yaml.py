@@ -0,0 +1,36 @@
+"""Tests for the YAML parser's fast path for long lists of numbers."""
+import yaml
+import numpy
+import pytest
+from uniplot.parse.yaml import ARRAY_THRESHOLD, ArrayLoader
+
+
+def load_both(values):
+    """Load an inline list with ArrayLoader and with yaml.safe_load."""
+    text = 'values: [{}]\n'.format(', '.join(values))
+    return (
+        yaml.load(text, Loader=ArrayLoader)['values'],
+        yaml.safe_load(text)['values'],
+    )
+
+
+@pytest.mark.parametrize('extra', [
+    ['010'], ['0.5', '010'], ['-010', '2.5'], ['0', '0.0', '0x1f', '1.5'],
+])
+def test_matches_safe_load(extra):
+    """Octal, hex and zero are read as PyYAML reads them."""
+    values = [str(i) for i in range(ARRAY_THRESHOLD)] + ['1.5'] + extra
+
+    fast, slow = load_both(values)
+
+    numpy.testing.assert_array_equal(numpy.asarray(fast, dtype=float), slow)
+
+
+def test_long_lists_are_arrays():
+    """Lists of plain numbers skip building a Python object for each."""
+    values = [str(i / 2) for i in range(ARRAY_THRESHOLD)]
+
+    fast, slow = load_both(values)
+
+    assert isinstance(fast, numpy.ndarray)
+    numpy.testing.assert_array_equal(fast, slow)
@@ -1 +1,15 @@
 """Plot graphs from human-readable file formats."""
+
+
+def __getattr__(name):
+    """Import the rendering API only once it is used.
+
+    Plotting needs matplotlib, which would otherwise slow down every command.
+    """
+    if name in ('render', 'render_bytes'):
+        from . import plot
+        return getattr(plot, name)
+
+    raise AttributeError(
+        "module '{}' has no attribute '{}'".format(__name__, name)
+    )
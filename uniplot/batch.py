@@ -0,0 +1,154 @@
+"""Renders many input files across a pool of worker processes."""
+import os
+import os.path
+import glob
+import time
+import multiprocessing
+
+
+def expand_inputs(patterns, manifest=None):
+    """Expand glob patterns and a manifest file into a list of jobs.
+
+    Each job is an (input, output) tuple, output is None if the manifest did
+    not give one. The manifest has one input per line, optionally followed by
+    whitespace and an output name. Blank lines and lines starting with '#' are
+    ignored.
+    """
+    jobs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            # let the worker report the missing file in the summary
+            matches = [pattern]
+        jobs.extend((m, None) for m in matches)
+
+    if manifest is not None:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line == '' or line.startswith('#'):
+                    continue
+                fields = line.split(None, 1)
+                jobs.append((fields[0], fields[1] if len(fields) > 1 else None))
+
+    seen = set()
+    unique = []
+    for job in jobs:
+        if job[0] not in seen:
+            seen.add(job[0])
+            unique.append(job)
+
+    return unique
+
+
+def output_name(input_file, fmt, output_dir=None):
+    """Name of the file that input_file is rendered to in batch mode."""
+    name = os.path.splitext(input_file)[0]
+    if output_dir is not None:
+        name = os.path.join(output_dir, os.path.basename(name))
+
+    return name + '.' + fmt
+
+
+def split_collisions(jobs):
+    """Separate the jobs which would overwrite the outputs of an earlier job.
+
+    jobs are (input, outputs) tuples where outputs is a list of names, such as
+    those of two inputs with the same name in different directories. Returns
+    the jobs to render along with a failed summary, as returned by `run`, for
+    each of the others.
+    """
+    owners = {}
+    unique = []
+    collisions = []
+    for (input_file, outputs) in jobs:
+        paths = [os.path.normcase(os.path.abspath(o)) for o in outputs]
+        clashes = [
+            (o, owners[p]) for (o, p) in zip(outputs, paths) if p in owners
+        ]
+        if clashes:
+            error = 'output {} is also rendered from {}'.format(*clashes[0])
+            collisions.append((input_file, outputs, error, 0.0, False))
+        else:
+            owners.update((p, input_file) for p in paths)
+            unique.append((input_file, outputs))
+
+    return unique, collisions
+
+
+def warm_up():
+    """Import and exercise matplotlib and the parsers once per worker."""
+    import warnings
+    from .plot import new_figure
+    from .parse.registry import Registry
+
+    fig = new_figure()
+    fig.add_subplot(1, 1, 1).plot([0, 1], [0, 1], label='warm up')
+    fig.canvas.draw()
+
+    for info in Registry.load().parsers:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                info.load()
+        except Exception:
+            # find_parser will report this properly if it's ever needed
+            pass
+
+
+def render_job(job):
+    """Render a single job, returning a summary rather than raising."""
+    from .cli import render_file
+
+    input_file, output_file, options = job
+    start = time.perf_counter()
+    rendered = False
+    try:
+        rendered = render_file(input_file, output_file, **options)
+    except (Exception, SystemExit) as e:
+        error = '{}: {}'.format(e.__class__.__name__, e)
+    else:
+        error = None
+
+    return (
+        input_file, output_file, error, time.perf_counter() - start, rendered
+    )
+
+
+def run(jobs, processes=None, **options):
+    """Render every (input, output) job, returning a list of summaries.
+
+    options are passed on to `cli.render_file`. Each summary is an (input,
+    output, error, seconds, rendered) tuple where error is None if the job
+    succeeded and rendered is False if the output was already up to date. A
+    failing job never stops the others.
+    """
+    jobs = [(i, o, options) for (i, o) in jobs]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+
+    if processes == 1:
+        warm_up()
+        return [render_job(job) for job in jobs]
+
+    with multiprocessing.Pool(processes, initializer=warm_up) as pool:
+        return list(pool.imap_unordered(render_job, jobs, chunksize=1))
+
+
+def summarise(results, elapsed, file):
+    """Print a summary of a batch run, returning the number of failures."""
+    failures = [r for r in results if r[2] is not None]
+    for (input_file, _, error, _, _) in failures:
+        print('{}: {}'.format(input_file, error), file=file)
+
+    current = sum(1 for r in results if r[2] is None and not r[4])
+    print(
+        'rendered {} of {} files ({} up to date) in {:.2f}s'.format(
+            len(results) - len(failures) - current, len(results), current,
+            elapsed,
+        ),
+        file=file,
+    )
+
+    return len(failures)
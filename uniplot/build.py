@@ -0,0 +1,101 @@
+"""Skips rendering outputs which are already up to date."""
+import os
+import os.path
+import hashlib
+import tempfile
+from .__about__ import __version__
+
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.uniplot', 'manifest')
+
+
+def fingerprint(files, settings=()):
+    """Fingerprint everything that an output depends on.
+
+    files are fingerprinted by their size and modification time, a file which
+    doesn't exist is fingerprinted as missing so that creating it changes the
+    fingerprint. settings can be anything with a stable repr, such as the name
+    of the style. The versions of uniplot and matplotlib are always included.
+    """
+    import matplotlib
+
+    digest = hashlib.sha1()
+    digest.update(repr((
+        __version__, matplotlib.__version__, tuple(settings)
+    )).encode())
+
+    for path in sorted(set(os.path.abspath(f) for f in files)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            ident = (path, None)
+        else:
+            ident = (path, stat.st_size, stat.st_mtime_ns)
+        digest.update(repr(ident).encode())
+
+    return digest.hexdigest()
+
+
+def graph_files(graph):
+    """List the files a parsed (but not necessarily loaded) plot.Graph uses.
+
+    Covers the files the graph was parsed from, every data file it references
+    and its stylesheet.
+    """
+    from .plot import user_style
+
+    files = list(graph.sources) + list(graph.data_files)
+    style_file = user_style(graph.style)
+    if style_file is not None:
+        files.append(style_file)
+
+    return files
+
+
+class Manifest:
+
+    """Records the fingerprint that each output was last rendered with.
+
+    Along with the fingerprint each output keeps the list of files it was
+    rendered from, so whether it is up to date is known without parsing the
+    plot file again. Each output has its own small file in the manifest
+    directory so that several processes can record outputs at once.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        """Set internal variables."""
+        self.directory = directory
+
+    def is_current(self, output, settings=()):
+        """Determine if output exists and none of its files have changed.
+
+        settings are those the output was fingerprinted with.
+        """
+        if not os.path.exists(output):
+            return False
+
+        try:
+            with open(self._path(output)) as f:
+                recorded, *files = f.read().splitlines()
+        except (FileNotFoundError, ValueError):
+            return False
+
+        # the plot file is always listed, unless this is an old record
+        return bool(files) and recorded == fingerprint(files, settings)
+
+    def record(self, output, fingerprint, files):
+        """Store the fingerprint of files that output was just rendered from.
+
+        The fingerprint is taken before rendering, so that a file which
+        changes during the render is rendered again next time.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        files = sorted(set(os.path.abspath(f) for f in files))
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(''.join(line + '\n' for line in [fingerprint] + files))
+        os.replace(tmp, self._path(output))
+
+    def _path(self, output):
+        name = hashlib.sha1(os.path.abspath(output).encode()).hexdigest()
+        return os.path.join(self.directory, name)
@@ -0,0 +1,150 @@
+"""Caches columns parsed from text data files on disk."""
+import os
+import os.path
+import hashlib
+import tempfile
+
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.uniplot', 'cache')
+DEFAULT_SIZE_LIMIT = 1024**3
+# number of bytes hashed from each end of a data file
+_SAMPLE_SIZE = 1024**2
+
+
+class DataCache:
+
+    """Stores parsed columns as .npy files and memory-maps them on later runs.
+
+    Entries are keyed by the path, size, modification time and a hash of the
+    content of the data file, so editing the file invalidates its entries. Once
+    the cache grows beyond size_limit bytes the least recently used entries are
+    removed.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, size_limit=DEFAULT_SIZE_LIMIT):
+        """Set internal variables."""
+        self.directory = directory
+        self.size_limit = size_limit
+
+    def key(self, filename, skiprows, delimiter):
+        """Calculate the key for a parsed data file."""
+        stat = os.stat(filename)
+        ident = (
+            os.path.abspath(filename), stat.st_size, stat.st_mtime_ns,
+            skiprows, delimiter,
+        )
+
+        digest = hashlib.sha1(repr(ident).encode())
+        digest.update(content_hash(filename, stat.st_size))
+        return digest.hexdigest()
+
+    def get(self, key, column):
+        """Memory-map a cached column, returning None if it isn't cached."""
+        import numpy
+
+        path = self._path(key, column)
+        try:
+            array = numpy.load(path, mmap_mode='r')
+            # mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # a corrupt entry is treated as missing and will be replaced
+            self._remove(path)
+            return None
+
+        return array
+
+    def put(self, key, column, array):
+        """Store a column then evict old entries if the cache is too big."""
+        import numpy
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, numpy.ascontiguousarray(array))
+            # atomic so other processes never see a partially written entry
+            os.replace(tmp, self._path(key, column))
+        except BaseException:
+            self._remove(tmp)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """List (path, size, last used time) of every entry."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for name in names:
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until under the size limit."""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for (path, size, _) in entries:
+            if total <= self.size_limit:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove every entry, returning the number of bytes freed."""
+        freed = 0
+        for (path, size, _) in self.entries():
+            self._remove(path)
+            freed += size
+
+        return freed
+
+    def stats(self):
+        """Summarise the contents of the cache."""
+        entries = self.entries()
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'size': sum(e[1] for e in entries),
+            'size_limit': self.size_limit,
+        }
+
+    def _path(self, key, column):
+        return os.path.join(self.directory, '{}-{}.npy'.format(key, column))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def content_hash(filename, size):
+    """Hash the start and end of a file.
+
+    Hashing the whole of a multi-gigabyte file would cost almost as much as
+    parsing it, combined with the size and modification time this catches
+    files which have been rewritten in place.
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        digest.update(f.read(_SAMPLE_SIZE))
+        if size > 2*_SAMPLE_SIZE:
+            f.seek(-_SAMPLE_SIZE, os.SEEK_END)
+        digest.update(f.read(_SAMPLE_SIZE))
+
+    return digest.digest()
@@ -1,10 +1,11 @@
 """Handles the main running of the program from the command-line."""
 import os
 import os.path
+import sys
+import time
 import argparse
-from . import parse, plot
+from . import batch, build, cache, serve
 from .__about__ import __version__
-from matplotlib import pyplot
 
 
 def arg_setup():
@@ -29,8 +30,132 @@ def arg_setup():
         default='',
         help='specify the parser which should be used for the input file.',
     )
+    arg_parser.add_argument(
+        '-d', '--decimate',
+        type=decimation_method,
+        metavar='METHOD',
+        help='reduce long lines to the output resolution before drawing, '
+        'METHOD is minmax (exact) or lttb.',
+    )
+    arg_parser.add_argument(
+        '-b', '--batch',
+        nargs='+',
+        metavar='PATTERN',
+        help='render every file matching these glob patterns.',
+    )
+    arg_parser.add_argument(
+        '-m', '--manifest',
+        help='render every file listed in this manifest, one per line.',
+    )
+    arg_parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='number of worker processes to use in batch mode.',
+    )
+    arg_parser.add_argument(
+        '--io-threads',
+        type=int,
+        metavar='N',
+        help='read up to N data files at once (default: 4).',
+    )
+    arg_parser.add_argument(
+        '--shards',
+        type=int,
+        metavar='N',
+        help='draw the subplots of PNG and other raster outputs in N '
+        'processes, 0 for one per CPU core.',
+    )
+    arg_parser.add_argument(
+        '-f', '--format',
+        type=formats,
+        help='file types to save as, separated by commas (default: pdf).',
+    )
+    arg_parser.add_argument(
+        '-t', '--thumbnail',
+        type=int,
+        action='append',
+        metavar='WIDTH',
+        help='also save a PNG thumbnail this many pixels wide, may be given '
+        'more than once.',
+    )
+    arg_parser.add_argument(
+        '-o', '--output-dir',
+        help='directory to save to in batch mode (default: next to input).',
+    )
+    arg_parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help="skip outputs whose inputs haven't changed since they were "
+        'last rendered.',
+    )
+    arg_parser.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        help='keep running and re-render whenever the input or its data '
+        'files change.',
+    )
+    arg_parser.add_argument(
+        '-c', '--cache',
+        action='store_true',
+        help='cache parsed data files in {}.'.format(cache.DEFAULT_DIR),
+    )
+    arg_parser.add_argument(
+        '--cache-size',
+        type=float,
+        default=cache.DEFAULT_SIZE_LIMIT / 1024**2,
+        metavar='MB',
+        help='evict old cache entries beyond this size (default: %(default)d).',
+    )
+    arg_parser.add_argument(
+        '--cache-clear',
+        action='store_true',
+        help='empty the data file cache and exit.',
+    )
+    arg_parser.add_argument(
+        '--cache-stats',
+        action='store_true',
+        help='display the size of the data file cache and exit.',
+    )
+    arg_parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help="append the time taken by each stage of rendering to FILE as "
+        "one line of JSON per input, '-' for stderr.",
+    )
+    arg_parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='also trace the peak memory of each stage, which is slow.',
+    )
+    arg_parser.add_argument(
+        '--cprofile',
+        metavar='DIR',
+        help='save a cProfile dump of rendering each input in DIR.',
+    )
+    arg_parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='run a server which renders files for other uniplot commands, '
+        'use -j to set the number of worker processes.',
+    )
+    arg_parser.add_argument(
+        '--socket',
+        default=serve.DEFAULT_SOCKET,
+        help='socket the server listens on (default: %(default)s).',
+    )
+    arg_parser.add_argument(
+        '--no-server',
+        action='store_true',
+        help="render in this process even if a server is running.",
+    )
+    arg_parser.add_argument(
+        '--server-stats',
+        action='store_true',
+        help='display the metrics of the running server and exit.',
+    )
     arg_parser.add_argument(
         'input',
+        nargs='?',
         help='file from which the data is read.',
     )
     arg_parser.add_argument(
@@ -42,24 +167,284 @@ def arg_setup():
     return arg_parser
 
 
-def main():
-    """Run the command-line program."""
-    args = vars(arg_setup().parse_args())
+def render_file(
+    input_file, output_file=None, parser='', style=None, data_cache=None,
+    decimation=None, manifest=None, thumbnails=(), profiler=None,
+    io_threads=None, shards=None,
+):
+    """Parse, plot and save a single file.
 
-    input_file = args['input']
-    name, ext = os.path.splitext(input_file)
+    output_file may be a list of names, the graph is only plotted once however
+    many there are. A thumbnail is also saved for each width in thumbnails, see
+    `thumbnail_name`. style and decimation are only used if the file doesn't
+    specify its own. If a build.Manifest is given then outputs which are up to
+    date are skipped. Returns False if the outputs were skipped. If a
+    profile.Profiler is given it records each stage. io_threads is the number
+    of data files read at once, see `data.DataFileLoader`, and shards the
+    number of processes raster outputs are drawn in, see `plot.render`.
+    """
+    from .data import DataFileLoader
 
-    plot_data = parse.parse_file(input_file, args['parser'])
-    if plot_data.style is None:
-        plot_data.style = args['style']
+    if profiler is not None:
+        with profiler.profile(input_file):
+            return render_file(
+                input_file, output_file, parser, style, data_cache,
+                decimation, manifest, thumbnails, io_threads=io_threads,
+                shards=shards,
+            )
 
-    output_file = args['output']
     if output_file is None:
-        output_file = name + '.pdf'
+        output_file = default_output(input_file)
+    outputs = output_file if isinstance(output_file, list) else [output_file]
+    thumbnails = [(thumbnail_name(outputs[0], w), w) for w in thumbnails]
+    every_output = outputs + [name for (name, _) in thumbnails]
+
+    # checked before parsing, which for some parsers reads many files
+    settings = (style, decimation)
+    if manifest is not None:
+        if all(manifest.is_current(o, settings) for o in every_output):
+            return False
+
+    plot_data = read_graph(
+        input_file, parser, DataFileLoader(data_cache, io_threads), style,
+        decimation,
+    )
+    if manifest is not None:
+        files = build.graph_files(plot_data)
+        fingerprint = build.fingerprint(files, settings)
+
+    # the data files are read while the figure is laid out
+    plot_data.prefetch()
+    save_graph(plot_data, outputs, thumbnails, shards)
+
+    if manifest is not None:
+        for output in every_output:
+            manifest.record(output, fingerprint, files)
 
-    fig = pyplot.figure()
-    plot.plot_with_style(plot_data, fig)
+    return True
+
+
+def read_graph(input_file, parser='', loader=None, style=None, decimation=None):
+    """Parse a file without loading its data files.
+
+    style and decimation are only used if the file doesn't specify its own.
+    """
+    from . import parse
+
+    plot_data = parse.parse_file(input_file, parser, loader, load=False)
+    if plot_data.style is None:
+        plot_data.style = style
+    if plot_data.decimate is None:
+        plot_data.decimate = decimation
+
+    return plot_data
+
+
+def save_graph(plot_data, output_file, thumbnails=(), shards=None):
+    """Plot a loaded graph and save it, see `plot.render`."""
+    from . import plot
 
     # TODO: this is ok for mulit plots but horrible for single
     #fig.set_figwidth(plot.plotwidth(fig, nrows, ncols))
-    fig.savefig(output_file)
+    plot.render(
+        plot_data, output_file, thumbnails=thumbnails, shards=shards
+    )
+
+
+def default_output(input_file):
+    """Save next to the input as a PDF."""
+    return os.path.splitext(input_file)[0] + '.pdf'
+
+
+def thumbnail_name(output_file, width):
+    """Name of the PNG thumbnail of output_file which is width pixels wide."""
+    return '{}-{}.png'.format(os.path.splitext(output_file)[0], width)
+
+
+def output_names(input_file, output_file, fmts, output_dir=None):
+    """Name the outputs of a file in each of fmts.
+
+    If output_file is given it is used as is when there are no fmts, otherwise
+    its extension is replaced by each of them. Without an output_file the
+    outputs are named as in batch mode, as PDFs by default.
+    """
+    if output_file is not None:
+        if not fmts:
+            return [output_file]
+        else:
+            base = os.path.splitext(output_file)[0]
+            return [base + '.' + fmt for fmt in fmts]
+
+    return [
+        batch.output_name(input_file, fmt, output_dir)
+        for fmt in fmts or ['pdf']
+    ]
+
+
+def formats(value):
+    """Split a comma separated --format argument."""
+    return [fmt.strip().lstrip('.') for fmt in value.split(',') if fmt.strip()]
+
+
+def decimation_method(name):
+    """Check a --decimate argument without importing matplotlib up front."""
+    from . import decimate
+
+    try:
+        return decimate.method(name)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def render_batch(args):
+    """Render every file given by --batch and --manifest."""
+    jobs = batch.expand_inputs(args['batch'] or [], args['manifest'])
+    if args['input'] is not None:
+        jobs.insert(0, (args['input'], args['output']))
+    jobs = [
+        (i, output_names(i, o, args['format'], args['output_dir']))
+        for (i, o) in jobs
+    ]
+    # inputs with the same name would silently overwrite each other's outputs
+    jobs, collisions = batch.split_collisions(jobs)
+
+    if args['output_dir'] is not None:
+        os.makedirs(args['output_dir'], exist_ok=True)
+
+    start = time.perf_counter()
+    sock = connect(args)
+    if sock is not None:
+        results = forward(sock, jobs, args)
+    else:
+        results = batch.run(jobs, args['jobs'], **render_options(args))
+    failures = batch.summarise(
+        collisions + results, time.perf_counter() - start, file=sys.stderr
+    )
+
+    return 1 if failures else 0
+
+
+def connect(args):
+    """Connect to the server unless told not to, None if there isn't one."""
+    if args['no_server']:
+        return None
+    else:
+        return serve.connect(args['socket'])
+
+
+def forward(sock, jobs, args):
+    """Have the server render (input, output) jobs, returning summaries.
+
+    The summaries are the same as those of `batch.run`. Jobs which the server
+    never answered, e.g. because it was stopped, are failures.
+    """
+    responses = serve.request(
+        sock, [{'input': i, 'output': o, 'args': args} for (i, o) in jobs]
+    )
+    summaries = {}
+    for r in responses:
+        summaries[r['id']] = (
+            jobs[r['id']][0], r.get('output'), r['error'], r['seconds'],
+            r.get('rendered', False),
+        )
+
+    return [
+        summaries.get(i, (
+            input, None, 'no response from the server', 0.0, False
+        ))
+        for (i, (input, _)) in enumerate(jobs)
+    ]
+
+
+def render_options(args):
+    """Pick out the arguments of render_file from the command-line."""
+    return {
+        'parser': args['parser'],
+        'style': args['style'],
+        'data_cache': data_cache(args),
+        'decimation': args['decimate'],
+        'manifest': build.Manifest() if args['incremental'] else None,
+        'thumbnails': args['thumbnail'] or (),
+        'profiler': profiler(args),
+        'io_threads': args['io_threads'],
+        'shards': args['shards'],
+    }
+
+
+def profiler(args):
+    """Create a profiler if one was asked for."""
+    if args['profile'] or args['profile_memory'] or args['cprofile']:
+        from .profile import Profiler
+
+        return Profiler(
+            args['profile'], args['profile_memory'], args['cprofile']
+        )
+    else:
+        return None
+
+
+def data_cache(args):
+    """Create the data file cache if it was asked for."""
+    if args['cache'] or args['cache_clear'] or args['cache_stats']:
+        return cache.DataCache(size_limit=int(args['cache_size'] * 1024**2))
+    else:
+        return None
+
+
+def main():
+    """Run the command-line program."""
+    # uniplot only ever saves files so never probe for a GUI backend
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    arg_parser = arg_setup()
+    args = vars(arg_parser.parse_args())
+
+    if args['cache_clear']:
+        freed = data_cache(args).clear()
+        print('freed {:.1f} MB'.format(freed / 1024**2))
+        sys.exit(0)
+    elif args['cache_stats']:
+        stats = data_cache(args).stats()
+        print('directory: {}'.format(stats['directory']))
+        print('entries: {}'.format(stats['entries']))
+        print('size: {:.1f} MB of {:.1f} MB'.format(
+            stats['size'] / 1024**2, stats['size_limit'] / 1024**2
+        ))
+        sys.exit(0)
+
+    if args['serve']:
+        sys.exit(serve.serve(args['socket'], args['jobs']))
+    elif args['server_stats']:
+        sock = serve.connect(args['socket'])
+        if sock is None:
+            arg_parser.exit(1, 'no server is listening on {}\n'.format(
+                args['socket']
+            ))
+        for metrics in serve.request(sock, [{'metrics': True}]):
+            for (name, value) in sorted(metrics.items()):
+                print('{}: {}'.format(name, value))
+        sys.exit(0)
+
+    if args['batch'] is not None or args['manifest'] is not None:
+        sys.exit(render_batch(args))
+    elif args['input'] is None:
+        arg_parser.error('the following arguments are required: input')
+    elif args['watch']:
+        from . import watch
+
+        options = render_options(args)
+        del options['manifest']
+        sys.exit(watch.watch(
+            args['input'],
+            output_names(args['input'], args['output'], args['format']),
+            **options
+        ))
+
+    outputs = output_names(args['input'], args['output'], args['format'])
+    sock = connect(args)
+    if sock is not None:
+        [(_, _, error, _, _)] = forward(sock, [(args['input'], outputs)], args)
+        if error is not None:
+            arg_parser.exit(1, '{}: {}\n'.format(args['input'], error))
+    else:
+        render_file(args['input'], outputs, **render_options(args))
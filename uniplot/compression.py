@@ -0,0 +1,50 @@
+"""Opens files which may be compressed, choosing the codec by extension."""
+import lzma
+import os.path
+import importlib
+
+
+# maps the extension of a compressed file to the module which decompresses it
+CODECS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'lzma',
+}
+
+# raised while reading a file which is corrupt or isn't really compressed
+ERRORS = (OSError, EOFError, lzma.LZMAError)
+
+
+def split(filename):
+    """Split off the compression extension, returning (name, extension).
+
+    The extension is '' if the file isn't compressed.
+    """
+    name, ext = os.path.splitext(filename)
+    if ext.lower() in CODECS:
+        return name, ext
+    else:
+        return filename, ''
+
+
+def strip(filename):
+    """Name of the file once decompressed, 'a.csv.gz' becomes 'a.csv'."""
+    return split(filename)[0]
+
+
+def is_compressed(filename):
+    """Determine if the file needs decompressing, by its extension."""
+    return split(filename)[1] != ''
+
+
+def open_file(filename, mode='rb', **kwargs):
+    """Open a file, decompressing it as it is read if it is compressed.
+
+    kwargs are passed on to `open`, such as the encoding of a text mode.
+    """
+    ext = split(filename)[1]
+    if not ext:
+        return open(filename, mode, **kwargs)
+
+    codec = importlib.import_module(CODECS[ext.lower()])
+    return codec.open(filename, mode, **kwargs)
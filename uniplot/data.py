@@ -0,0 +1,783 @@
+"""Loads the data which plots reference from data files."""
+import io
+import time
+import os.path
+import warnings
+import collections
+import numpy
+from numpy.lib import NumpyVersion
+from . import compression, profile
+
+
+# number of bytes of a text data file which are parsed at once
+CHUNK_SIZE = 16 * 1024**2
+
+# number of rows of a binary data file which are binned at once
+HISTOGRAM_ROWS = 2**20
+
+# number of data files which are read at once by default
+DEFAULT_IO_THREADS = 4
+
+# NumPy 1.23 replaced the per-row Python loop in loadtxt with a C parser
+_C_LOADTXT = NumpyVersion(numpy.__version__) >= '1.23.0'
+
+
+class Reference:
+
+    """Base class of references to data stored in a file.
+
+    Each subclass is a namedtuple with a `filename` field. Those which are
+    read from their file define a `group` property and a `read(refs)` class
+    method, which reads every reference in a group in a single call and
+    returns a list of arrays. An `ExpressionReference` is evaluated from the
+    columns it references instead.
+    """
+
+    __slots__ = ()
+
+
+class ColumnReference(Reference, collections.namedtuple(
+    'ColumnReference', ['filename', 'column', 'skiprows']
+)):
+
+    """A single column of a text data file.
+
+    Written in plot files as 'filename:column:skiprows'.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, file_info_str):
+        """Parse a 'filename:column:skiprows' string."""
+        file_info = file_info_str.split(':')
+        return cls(
+            file_info[0],
+            int(file_info[1]),
+            0 if len(file_info) < 3 else int(file_info[2]),
+        )
+
+    @property
+    def delimiter(self):
+        """CSV files are comma delimited, anything else is whitespace.
+
+        Compressed files are delimited by the extension inside, so 'a.csv.gz'
+        is a CSV file.
+        """
+        ext = os.path.splitext(compression.strip(self.filename))[1]
+        return ',' if ext == '.csv' else None
+
+    @property
+    def group(self):
+        """References in the same group can be read in a single pass."""
+        return ('text', self.filename, self.skiprows, self.delimiter)
+
+    @classmethod
+    def read(cls, refs):
+        """Read only the needed columns in a single pass."""
+        return read_columns(
+            refs[0].filename, [r.column for r in refs], refs[0].skiprows,
+            refs[0].delimiter,
+        )
+
+
+class NpyReference(Reference, collections.namedtuple(
+    'NpyReference', ['filename', 'column']
+)):
+
+    """An array, or a single column of an array, in a .npy file.
+
+    Written in plot files as 'filename.npy' or 'filename.npy:column'.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, file_info_str):
+        """Parse a 'filename.npy:column' string."""
+        file_info = file_info_str.split(':')
+        return cls(
+            file_info[0], None if len(file_info) < 2 else int(file_info[1])
+        )
+
+    @property
+    def group(self):
+        """Every reference to the same file shares one memory-map."""
+        return ('npy', self.filename)
+
+    @classmethod
+    def read(cls, refs):
+        """Memory-map the file and take a view of each column.
+
+        A compressed file can't be memory-mapped so it is decompressed into
+        memory instead.
+        """
+        filename = refs[0].filename
+        if compression.is_compressed(filename):
+            with compression.open_file(filename) as f:
+                array = numpy.load(f)
+        else:
+            array = numpy.load(filename, mmap_mode='r')
+        return [select_column(array, r.column, r.filename) for r in refs]
+
+
+class NpzReference(Reference, collections.namedtuple(
+    'NpzReference', ['filename', 'key', 'column']
+)):
+
+    """An array, or a single column of an array, in a .npz file.
+
+    Written in plot files as 'filename.npz:key' or 'filename.npz:key:column'.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, file_info_str):
+        """Parse a 'filename.npz:key:column' string."""
+        file_info = file_info_str.split(':')
+        if len(file_info) < 2:
+            raise ValueError(
+                "'{}' does not name an array in the archive".format(
+                    file_info_str
+                )
+            )
+
+        return cls(
+            file_info[0],
+            file_info[1],
+            None if len(file_info) < 3 else int(file_info[2]),
+        )
+
+    @property
+    def group(self):
+        """Every reference to the same archive shares one open file."""
+        return ('npz', self.filename)
+
+    @classmethod
+    def read(cls, refs):
+        """Load each named array from the archive.
+
+        Archive members can't be memory-mapped so each one is read into
+        memory, but only the members which are used are read.
+        """
+        with compression.open_file(refs[0].filename) as f, \
+                numpy.load(f) as archive:
+            arrays = {key: archive[key] for key in set(r.key for r in refs)}
+
+        return [
+            select_column(arrays[r.key], r.column, r.filename) for r in refs
+        ]
+
+
+class RawReference(Reference, collections.namedtuple(
+    'RawReference', ['filename', 'column', 'dtype', 'ncolumns']
+)):
+
+    """A single column of a raw little-endian binary file.
+
+    Written in plot files as 'filename:column:dtype:ncolumns' where the file
+    holds ncolumns interleaved values of type dtype (e.g. 'f4' or 'i2') per
+    row. dtype defaults to 'f8' and ncolumns defaults to 1.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, file_info_str):
+        """Parse a 'filename:column:dtype:ncolumns' string."""
+        file_info = file_info_str.split(':')
+        return cls(
+            file_info[0],
+            0 if len(file_info) < 2 else int(file_info[1]),
+            numpy.dtype(
+                'f8' if len(file_info) < 3 else file_info[2]
+            ).newbyteorder('<'),
+            1 if len(file_info) < 4 else int(file_info[3]),
+        )
+
+    @property
+    def group(self):
+        """Every reference with the same layout shares one memory-map."""
+        return ('raw', self.filename, self.dtype, self.ncolumns)
+
+    @classmethod
+    def read(cls, refs):
+        """Memory-map the file and take a view of each column.
+
+        A compressed file is decompressed into memory instead.
+        """
+        filename, _, dtype, ncolumns = refs[0]
+        if compression.is_compressed(filename):
+            with compression.open_file(filename) as f:
+                buffer = f.read()
+            size = len(buffer)
+        else:
+            size = os.path.getsize(filename)
+
+        row_size = dtype.itemsize * ncolumns
+        if size % row_size != 0:
+            raise ValueError(
+                "size of '{}' is not a multiple of {} columns of {}".format(
+                    filename, ncolumns, dtype
+                )
+            )
+
+        if compression.is_compressed(filename):
+            rows = numpy.frombuffer(buffer, dtype=dtype)
+        else:
+            rows = numpy.memmap(filename, dtype=dtype, mode='r')
+        rows = rows.reshape(-1, ncolumns)
+        return [select_column(rows, r.column, filename) for r in refs]
+
+
+# maps file extensions to the reference which reads them, anything else is text
+_BINARY_REFERENCES = {
+    '.npy': NpyReference,
+    '.npz': NpzReference,
+    '.bin': RawReference,
+    '.raw': RawReference,
+}
+
+
+def parse_reference(file_info_str):
+    """Parse a reference to data in a file, choosing type by file extension.
+
+    The extension of a compressed file is the one inside, see `compression`.
+    """
+    filename = compression.strip(file_info_str.split(':')[0])
+    ext = os.path.splitext(filename)[1]
+    return _BINARY_REFERENCES.get(ext, ColumnReference).from_string(
+        file_info_str
+    )
+
+
+class HistogramReference(Reference, collections.namedtuple(
+    'HistogramReference', ['source', 'bins', 'range', 'part']
+)):
+
+    """The counts, or bin centres, of a histogram of a column in a file.
+
+    Written in plot files as {'histogram': 'filename:column', 'bins': 100,
+    'range': [low, high]} where the histogram is of any other reference. bins
+    is a number of equal bins (10 by default) or a list of bin edges. A number
+    of bins without a range means the file is read twice, once to find the
+    lowest and highest values. part is 'counts' or 'centres'.
+
+    The column is binned a chunk at a time as it is read, so memory use
+    doesn't depend on the length of the column.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Parse a {'histogram': ..., 'bins': ..., 'range': ...} dict."""
+        bins = spec.get('bins', 10)
+        if isinstance(bins, (int, float)):
+            bins = int(bins)
+            if bins < 1:
+                raise ValueError('a histogram needs at least one bin')
+        else:
+            bins = tuple(float(b) for b in bins)
+            if len(bins) < 2:
+                raise ValueError('a histogram needs at least two bin edges')
+
+        limits = spec.get('range')
+        if limits is not None:
+            low, high = map(float, limits)
+            if low > high:
+                raise ValueError('histogram range must be [low, high]')
+            limits = (low, high)
+
+        return cls(parse_reference(spec['histogram']), bins, limits, 'counts')
+
+    @property
+    def filename(self):
+        """The file which the histogram is of."""
+        return self.source.filename
+
+    @property
+    def group(self):
+        """Every histogram of the same file is binned in a single pass."""
+        return ('histogram',) + self.source.group
+
+    def centres(self):
+        """Reference the centres of the bins of this histogram."""
+        return self._replace(part='centres')
+
+    @classmethod
+    def read(cls, refs):
+        """Bin every referenced column in one pass through the file."""
+        # dicts keep the order the references were requested in
+        sources = list(dict.fromkeys(r.source for r in refs))
+        histograms = list(dict.fromkeys(
+            (r.source, r.bins, r.range) for r in refs
+        ))
+
+        # explicit bin edges don't need the range of the data
+        unbounded = list(dict.fromkeys(
+            source for (source, bins, limit) in histograms
+            if limit is None and not isinstance(bins, tuple)
+        ))
+        limits = find_limits(unbounded) if unbounded else {}
+
+        edges = {}
+        counts = {}
+        for key in histograms:
+            source, bins, limit = key
+            if isinstance(bins, tuple):
+                edges[key] = numpy.array(bins)
+            else:
+                low, high = limits[source] if limit is None else limit
+                if low == high:
+                    # as numpy.histogram does
+                    low, high = low - 0.5, high + 0.5
+                edges[key] = numpy.linspace(low, high, bins + 1)
+            counts[key] = numpy.zeros(len(edges[key]) - 1, dtype=numpy.int64)
+
+        for chunk in iter_sources(sources):
+            values = dict(zip(sources, chunk))
+            for key in histograms:
+                source, bins, _ = key
+                if isinstance(bins, tuple):
+                    counts[key] += numpy.histogram(
+                        values[source], edges[key]
+                    )[0]
+                else:
+                    # equal bins are counted without a search
+                    counts[key] += numpy.histogram(
+                        values[source], bins,
+                        range=(edges[key][0], edges[key][-1]),
+                    )[0]
+
+        arrays = []
+        for r in refs:
+            key = (r.source, r.bins, r.range)
+            if r.part == 'centres':
+                arrays.append((edges[key][:-1] + edges[key][1:]) / 2)
+            else:
+                arrays.append(counts[key])
+
+        return arrays
+
+
+def iter_sources(sources):
+    """Yield chunks of references to one file, each a list of arrays.
+
+    Text files are parsed a chunk at a time, binary files are memory-mapped
+    then split into chunks of rows.
+    """
+    if isinstance(sources[0], ColumnReference):
+        ordered = sorted(set(s.column for s in sources))
+        with compression.open_file(sources[0].filename) as f:
+            for chunk in iter_columns(
+                f, ordered, sources[0].skiprows, sources[0].delimiter
+            ):
+                columns = dict(zip(ordered, chunk))
+                yield [columns[s.column] for s in sources]
+    else:
+        arrays = type(sources[0]).read(sources)
+        rows = max(len(a) for a in arrays)
+        for start in range(0, rows, HISTOGRAM_ROWS):
+            yield [a[start:start + HISTOGRAM_ROWS] for a in arrays]
+
+
+def find_limits(sources):
+    """Find the lowest and highest finite value of each reference."""
+    limits = {}
+    for chunk in iter_sources(sources):
+        for (source, values) in zip(sources, chunk):
+            values = values[numpy.isfinite(values)]
+            if not len(values):
+                continue
+
+            low, high = values.min(), values.max()
+            if source in limits:
+                low = min(low, limits[source][0])
+                high = max(high, limits[source][1])
+            limits[source] = (float(low), float(high))
+
+    for source in sources:
+        if source not in limits:
+            raise ValueError(
+                "'{}' has no values to make a histogram of".format(
+                    source.filename
+                )
+            )
+
+    return limits
+
+
+class ExpressionReference(Reference, collections.namedtuple(
+    'ExpressionReference', ['expression', 'columns']
+)):
+
+    """An expression evaluated over columns of a data file.
+
+    Written in plot files as {'expression': 'log10(col2)', 'file': 'filename',
+    'skiprows': 0}, see `expression.Expression`. columns holds a reference to
+    each column used, which are read along with every other column of the file
+    and the expression is evaluated once they have all been read.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Parse an {'expression': ..., 'file': ..., 'skiprows': ...} dict."""
+        from .expression import Expression
+
+        expression = Expression(spec['expression'])
+        if not expression.columns:
+            raise ValueError(
+                "the expression '{}' doesn't use any columns".format(
+                    expression.text
+                )
+            )
+
+        skiprows = spec.get('skiprows', 0)
+        suffix = ':{}'.format(skiprows) if skiprows else ''
+        columns = tuple(
+            parse_reference('{}:{}{}'.format(spec['file'], c, suffix))
+            for c in expression.columns
+        )
+
+        return cls(expression, columns)
+
+    @property
+    def filename(self):
+        """The file which the columns are read from."""
+        return self.columns[0].filename
+
+    def evaluate(self, arrays):
+        """Evaluate with the arrays of each of columns."""
+        return self.expression(dict(zip(self.expression.columns, arrays)))
+
+
+class DataFileLoader:
+
+    """Loads columns from data files, reading each file only once.
+
+    Columns are first requested, which returns a reference to the column, then
+    once every column is known they are all loaded together. Up to threads
+    files are read at once, which hides the latency of slow filesystems. If a
+    DataCache is given, columns parsed from text files are stored in it and
+    read back from it next time.
+    """
+
+    def __init__(self, cache=None, threads=None):
+        """Set internal variables."""
+        self.cache = cache
+        self.threads = DEFAULT_IO_THREADS if threads is None else threads
+        # maps each group to the references needed from it
+        self._groups = collections.OrderedDict()
+        # maps each reference to its loaded array
+        self._columns = {}
+        # maps each group being read in the background to its future
+        self._pending = collections.OrderedDict()
+        # expressions to evaluate once their columns have been read
+        self._expressions = []
+
+    def request(self, file_info_str):
+        """Register a column which will be needed, returning its reference.
+
+        A Reference may be given instead of a string.
+        """
+        if isinstance(file_info_str, Reference):
+            ref = file_info_str
+        else:
+            ref = parse_reference(file_info_str)
+
+        if isinstance(ref, ExpressionReference):
+            for column in ref.columns:
+                self.request(column)
+            if ref not in self._expressions:
+                self._expressions.append(ref)
+            return ref
+        refs = self._groups.setdefault(ref.group, [])
+        if ref not in refs:
+            refs.append(ref)
+
+        return ref
+
+    def prefetch(self):
+        """Start reading every requested column in the background.
+
+        Returns straight away, `load` waits for the reads to finish. Does
+        nothing unless more than one file can be read at once.
+        """
+        groups = [
+            (group, refs) for (group, refs) in self._unread()
+            if group not in self._pending
+        ]
+        if self.threads < 2 or not groups:
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(min(self.threads, len(groups)))
+        for (group, refs) in groups:
+            self._pending[group] = (refs, executor.submit(self._timed, refs))
+        # the threads exit once the reads are done
+        executor.shutdown(wait=False)
+
+    def load(self):
+        """Read every requested column which hasn't been read yet."""
+        self.prefetch()
+
+        while self._pending:
+            group, (refs, future) = self._pending.popitem(last=False)
+            arrays, seconds = future.result()
+            self._columns.update(zip(refs, arrays))
+            # stages in other threads aren't recorded, so record it here
+            profile.record(
+                'read', seconds, file=refs[0].filename, columns=len(refs),
+                **summarise(arrays)
+            )
+
+        # everything when reading one file at a time, otherwise anything
+        # requested from a group after it was prefetched
+        for (group, refs) in self._unread():
+            with profile.stage(
+                'read', file=refs[0].filename, columns=len(refs)
+            ) as record:
+                arrays = self._read(refs)
+                record.update(summarise(arrays))
+
+            self._columns.update(zip(refs, arrays))
+
+        for ref in self._expressions:
+            if ref not in self._columns:
+                text = ref.expression.text
+                with profile.stage('expression', expression=text):
+                    self._columns[ref] = ref.evaluate(
+                        [self._columns[c] for c in ref.columns]
+                    )
+
+    def get(self, ref):
+        """Return the array for a reference, loading it if necessary."""
+        if ref not in self._columns:
+            self.load()
+
+        return self._columns[ref]
+
+    def forget(self, filenames):
+        """Drop every column of the given files so they are read again."""
+        filenames = set(filenames)
+        for group in list(self._groups):
+            if self._groups[group][0].filename in filenames:
+                del self._groups[group]
+                self._pending.pop(group, None)
+        self._expressions = [
+            r for r in self._expressions if r.filename not in filenames
+        ]
+        for ref in list(self._columns):
+            if ref.filename in filenames:
+                del self._columns[ref]
+
+    def forget_expressions(self, keep=()):
+        """Drop the values of every expression except those in keep.
+
+        The columns they were calculated from are kept.
+        """
+        keep = set(keep)
+        for ref in self._expressions:
+            if ref not in keep:
+                self._columns.pop(ref, None)
+        self._expressions = [r for r in self._expressions if r in keep]
+
+    def _unread(self):
+        """List (group, references) of the columns which haven't been read."""
+        unread = []
+        for (group, refs) in self._groups.items():
+            refs = [r for r in refs if r not in self._columns]
+            if refs:
+                unread.append((group, refs))
+
+        return unread
+
+    def _read(self, refs):
+        """Read the references of one group, returning a list of arrays."""
+        if isinstance(refs[0], ColumnReference):
+            ordered = sorted(refs)
+            arrays = dict(zip(ordered, self._load_text(ordered)))
+            return [arrays[r] for r in refs]
+        else:
+            return type(refs[0]).read(refs)
+
+    def _timed(self, refs):
+        """Read the references of one group, returning (arrays, seconds)."""
+        start = time.perf_counter()
+        arrays = self._read(refs)
+        return arrays, time.perf_counter() - start
+
+    def _load_text(self, refs):
+        """Load columns of a text file, using the cache if there is one."""
+        columns = {}
+        if self.cache is not None:
+            key = self.cache.key(
+                refs[0].filename, refs[0].skiprows, refs[0].delimiter
+            )
+            for ref in refs:
+                array = self.cache.get(key, ref.column)
+                if array is not None:
+                    columns[ref] = array
+            missing = [r for r in refs if r not in columns]
+        else:
+            missing = refs
+
+        if missing:
+            arrays = ColumnReference.read(missing)
+            columns.update(zip(missing, arrays))
+
+            if self.cache is not None:
+                for (ref, array) in zip(missing, arrays):
+                    self.cache.put(key, ref.column, array)
+
+        return [columns[r] for r in refs]
+
+
+def summarise(arrays):
+    """Describe the arrays read from a file for the profiler."""
+    return {
+        'rows': max(len(a) for a in arrays),
+        'bytes': sum(int(a.nbytes) for a in arrays),
+    }
+
+
+def select_column(array, column, filename):
+    """Take a view of one column of a 2D array, or all of a 1D array."""
+    if column is None:
+        return array
+    elif array.ndim != 2:
+        raise ValueError(
+            "can't take column {} of a {}D array in '{}'".format(
+                column, array.ndim, filename
+            )
+        )
+    else:
+        return array[:, column]
+
+
+def read_columns(filename, columns, skiprows=0, delimiter=None):
+    """Read only the given columns of a text file in a single pass.
+
+    Compressed files are decompressed as they are read.
+    """
+    if _C_LOADTXT:
+        # loadtxt already reads in chunks and only converts the needed
+        # columns, all in C, which is as fast as we can get
+        if compression.is_compressed(filename):
+            with compression.open_file(
+                filename, 'rt', encoding='latin-1'
+            ) as f:
+                table = numpy.loadtxt(
+                    f, delimiter=delimiter, usecols=columns,
+                    skiprows=skiprows, ndmin=2,
+                )
+        else:
+            table = numpy.loadtxt(
+                filename, delimiter=delimiter, usecols=columns,
+                skiprows=skiprows, ndmin=2,
+            )
+        return [table[:, i] for i in range(len(columns))]
+
+    with compression.open_file(filename) as f:
+        chunks = list(iter_columns(f, columns, skiprows, delimiter))
+
+    if not chunks:
+        return [numpy.empty(0) for _ in columns]
+    else:
+        return [
+            numpy.concatenate([c[i] for c in chunks])
+            for i in range(len(columns))
+        ]
+
+
+def iter_columns(
+    f, columns, skiprows=0, delimiter=None, chunk_size=CHUNK_SIZE,
+):
+    """Yield the given columns of a binary file object a chunk at a time.
+
+    Each chunk is a list of arrays, one for each column. Rows are never split
+    between chunks. Follows the semantics of `numpy.loadtxt`, so lines starting
+    with '#' are comments and blank lines are ignored.
+    """
+    for _ in range(skiprows):
+        f.readline()
+
+    remainder = b''
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+
+        block = remainder + block
+        end = block.rfind(b'\n') + 1
+        remainder = block[end:]
+        if end > 0 and block[:end].strip():
+            yield parse_chunk(block[:end], columns, delimiter)
+
+    if remainder.strip():
+        yield parse_chunk(remainder + b'\n', columns, delimiter)
+
+
+def parse_chunk(block, columns, delimiter=None):
+    """Convert the given columns of a block of complete lines."""
+    if _C_LOADTXT:
+        return _parse_loadtxt(block, columns, delimiter)
+    else:
+        return _parse_fromstring(block, columns, delimiter)
+
+
+def _parse_loadtxt(block, columns, delimiter):
+    """Parse with loadtxt, which only converts the needed columns.
+
+    This is the fast path on NumPy 1.23 onwards, where loadtxt is written in C,
+    and handles comments and malformed lines properly on older versions.
+    """
+    with warnings.catch_warnings():
+        # a chunk consisting only of comments is not worth warning about
+        warnings.simplefilter('ignore', UserWarning)
+        table = numpy.loadtxt(
+            io.StringIO(block.decode('latin-1')), delimiter=delimiter,
+            usecols=columns, ndmin=2,
+        )
+
+    return [table[:, i] for i in range(len(columns))]
+
+
+def _parse_fromstring(block, columns, delimiter):
+    """Parse every value in C at once then project out the needed columns.
+
+    Only used on old versions of NumPy where loadtxt loops over each row in
+    Python. Falls back to loadtxt if the block contains comments, blank lines
+    or anything else that would be ambiguous once the line structure is lost.
+    """
+    text = block.decode('latin-1')
+    first_line = text[:text.index('\n')]
+    if '#' in text or not first_line.strip():
+        return _parse_loadtxt(block, columns, delimiter)
+
+    if delimiter is not None:
+        ncols = len(first_line.split(delimiter))
+        text = text.replace(delimiter, ' ')
+    else:
+        ncols = len(first_line.split())
+    nrows = text.count('\n')
+
+    try:
+        with warnings.catch_warnings():
+            # older versions warn rather than raise on unparseable data
+            warnings.simplefilter('error', DeprecationWarning)
+            values = numpy.fromstring(text, sep=' ')
+    except (ValueError, DeprecationWarning):
+        return _parse_loadtxt(block, columns, delimiter)
+
+    if values.size != nrows*ncols or max(columns) >= ncols:
+        return _parse_loadtxt(block, columns, delimiter)
+
+    table = values.reshape(nrows, ncols)
+    # copy so the unused columns can be freed straight away
+    return [table[:, c].copy() for c in columns]
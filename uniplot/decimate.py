@@ -0,0 +1,140 @@
+"""Reduces large series to the points which can actually be seen."""
+import numpy
+from matplotlib import lines
+
+
+def minmax(x, y, starts):
+    """Keep the first, minimum, maximum and last point of each bucket.
+
+    The buckets are given by the index at which each one starts and must not
+    be empty. If there is one bucket per pixel column then a line drawn through
+    the result covers the same pixels as a line drawn through every point.
+    """
+    ends = numpy.append(starts[1:], len(x)) - 1
+
+    lows = numpy.minimum.reduceat(y, starts)
+    highs = numpy.maximum.reduceat(y, starts)
+    # order within a bucket doesn't matter since it's narrower than a pixel
+    middles = (x[starts] + x[ends]) / 2
+
+    return (
+        numpy.column_stack([x[starts], middles, middles, x[ends]]).ravel(),
+        numpy.column_stack([y[starts], lows, highs, y[ends]]).ravel(),
+    )
+
+
+def lttb(x, y, starts):
+    """Keep the point in each bucket which best preserves the shape.
+
+    Uses the Largest-Triangle-Three-Buckets algorithm, which looks smoother than
+    minmax but doesn't guarantee to keep every peak. The first and last points
+    are always kept.
+    """
+    bounds = numpy.append(starts, len(x))
+
+    keep = [0]
+    for i in range(len(starts)):
+        start, stop = bounds[i], bounds[i+1]
+        following = slice(stop, bounds[i+2] if i+2 < len(bounds) else len(x))
+        if following.start == following.stop:
+            following = slice(len(x) - 1, len(x))
+        mean_x = x[following].mean()
+        mean_y = y[following].mean()
+
+        prev_x = x[keep[-1]]
+        prev_y = y[keep[-1]]
+        areas = numpy.abs(
+            (prev_x - mean_x)*(y[start:stop] - prev_y) -
+            (prev_x - x[start:stop])*(mean_y - prev_y)
+        )
+        keep.append(start + numpy.argmax(areas))
+    keep.append(len(x) - 1)
+
+    return x[keep], y[keep]
+
+
+METHODS = {
+    'minmax': minmax,
+    'lttb': lttb,
+}
+
+
+def method(name):
+    """Normalise a decimation setting, True meaning the default method."""
+    if name is None or name is False:
+        return None
+    elif name is True:
+        return 'minmax'
+    elif name in METHODS:
+        return name
+    else:
+        raise ValueError("unknown decimation method '{}'".format(name))
+
+
+class DecimatedLine(lines.Line2D):
+
+    """A line which only draws as many points as there are pixels.
+
+    The full data is kept, so autoscaling is unaffected, but each time the line
+    is drawn its points are grouped into the pixel columns they will be drawn
+    in and each column is reduced using one of METHODS. Only lines whose x is
+    sorted and drawn on a linear scale are reduced.
+    """
+
+    def __init__(self, x, y, method='minmax', **kwargs):
+        """Set internal variables."""
+        super().__init__(x, y, **kwargs)
+        self.method = method
+        x = numpy.asarray(x)
+        self._sorted = x.ndim == 1 and bool(numpy.all(x[1:] >= x[:-1]))
+
+    def draw(self, renderer):
+        """Draw only the points which are visible at this resolution."""
+        x = self.get_xdata()
+        y = self.get_ydata()
+        reduced = self.reduce(numpy.asarray(x), numpy.asarray(y))
+        if reduced is None:
+            return super().draw(renderer)
+
+        self.set_data(*reduced)
+        try:
+            super().draw(renderer)
+        finally:
+            self.set_data(x, y)
+            self.stale = False
+
+    def reduce(self, x, y):
+        """Reduce to the current pixel columns, None if that isn't possible."""
+        if not self._sorted or self.axes.get_xscale() != 'linear':
+            return None
+
+        # x pixel coordinate is gradient*x + intercept, y is irrelevant
+        (p0, _), (p1, _) = self.get_transform().transform([[0, 1], [1, 1]])
+        gradient, intercept = p1 - p0, p0
+        if gradient == 0:
+            return None
+
+        # data coordinates of the boundary of each visible pixel column
+        left, right = self.axes.bbox.intervalx
+        columns = numpy.arange(numpy.floor(left), numpy.ceil(right) + 1)
+        bounds = numpy.sort((columns - intercept) / gradient)
+        if len(x) <= 4*len(bounds):
+            return None
+
+        # columns with no points in them share an index with the next column
+        edges = numpy.unique(numpy.searchsorted(x, bounds, side='left'))
+        start, stop = edges[0], edges[-1]
+        if start == stop:
+            return None
+
+        rx, ry = METHODS[self.method](
+            x[start:stop], y[start:stop], edges[:-1] - start
+        )
+        # keep the closest point either side of the view so the line still
+        # enters and leaves it at the right angle
+        before = slice(max(start - 1, 0), start)
+        after = slice(stop, stop + 1)
+        return (
+            numpy.concatenate([x[before], rx, x[after]]),
+            numpy.concatenate([y[before], ry, y[after]]),
+        )
@@ -1,60 +1,82 @@
 """Handles parsing the data file describing the plot."""
-import pkg_resources
 import warnings
+import glob
 import os.path
 import errno
 import os
 
-from .. import plot
+from .. import plot, profile
+from .registry import Registry
 
 
-def parse_file(filename, parsername=''):
-    """Parse plot info from given file using correct parser."""
-    if not os.path.exists(filename):
+def parse_file(filename, parsername='', loader=None, load=True):
+    """Parse plot info from given file using correct parser.
+
+    Data files are read using loader, see `plot.Graph`.
+    """
+    if not os.path.exists(filename) and not glob.glob(filename):
         num = errno.ENOENT
         raise FileNotFoundError(num, os.strerror(num), filename)
     elif parsername == '':
-        data = find_parser(filename)
+        parser, data = find_parser(filename)
     else:
-        data = load_parser(filename, parsername)
+        parser, data = load_parser(filename, parsername)
+
+    with profile.stage('graph'):
+        graph = plot.Graph(data, loader, load)
+    graph.sources = [filename]
+    if hasattr(parser, 'dependencies'):
+        graph.sources.extend(parser.dependencies())
 
-    return plot.Graph(data)
+    return graph
 
 
 def find_parser(filename):
-    """Find the correct parser by iterating entry_points."""
-    for ep in pkg_resources.iter_entry_points(group='uniplot.parsers'):
-        try:
-            parser = ep.load()(filename)
-        except ImportError:
-            # this parser couldn't be imported
-            warnings.warn("parser '{}' could not be loaded".format(ep.name))
-            continue
-        except pkg_resources.DistributionNotFound:
-            # this parser wasn't installed
-            continue
-
-        if parser.isfiletype():
-            return parser.parse()
-    else:
-        raise ImportError("no parser could be found for '{}'".format(filename))
+    """Find the correct parser using the parser registry.
+
+    Only parsers which might handle the file are imported. Returns the parser
+    and the data it parsed.
+    """
+    with profile.stage('find_parser') as record:
+        for info in Registry.load().candidates(filename):
+            try:
+                parser = info.load()(filename)
+            except ImportError:
+                # this parser couldn't be imported
+                warnings.warn(
+                    "parser '{}' could not be loaded".format(info.name)
+                )
+                continue
+
+            if parser.isfiletype():
+                record['parser'] = info.name
+                break
+        else:
+            raise ImportError(
+                "no parser could be found for '{}'".format(filename)
+            )
+
+    with profile.stage('parse', parser=info.name):
+        return parser, parser.parse()
 
 
 def load_parser(filename, parsername):
-    """Load only the specified entrypoint."""
-    eps = list(pkg_resources.iter_entry_points(
-        group='uniplot.parsers', name=parsername
-    ))
-    if len(eps) > 1:
+    """Load only the specified parser.
+
+    Returns the parser and the data it parsed.
+    """
+    infos = Registry.load().named(parsername)
+    if len(infos) > 1:
         warnings.warn("multiple parsers called '{}'".format(parsername))
-    elif len(eps) < 1:
+    elif len(infos) < 1:
         raise ImportError("parser '{}' could not be found".format(parsername))
 
     errors = []
-    for ep in eps:
+    for info in infos:
         try:
-            parser = ep.load()(filename)
-            return parser.parse()
+            parser = info.load()(filename)
+            with profile.stage('parse', parser=info.name):
+                return parser, parser.parse()
         except Exception as e:
             errors.append(e)
     else:
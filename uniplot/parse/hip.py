@@ -11,6 +11,8 @@ class HipParser:
     Syntax and other information: {}
     """.format(hippy.__about__.__homepage__)
 
+    extensions = ('.hip',)
+
     def __init__(self, filename):
         """Set internal variables."""
         self._name = filename
@@ -1,13 +1,46 @@
 """Parses Kromek Multi-Spect files."""
+import os
+import glob
 import numpy
 import os.path
+import datetime
+import tempfile
+import itertools
+import collections
+import multiprocessing
 import configparser
+import concurrent.futures
+from .. import compression
+
+
+# the first two lines of every Multi-Spect file
+HEADER = ['$SPEC_REM:', 'Multi-Spect']
+
+
+def read_header(f):
+    """Read the first two lines of an open file, None if it isn't text."""
+    try:
+        return [f.readline().strip(), f.readline().strip()]
+    except compression.ERRORS + (ValueError,):
+        # not compressed the way its extension says, or not text
+        return None
+
+
+def is_spectrum(path):
+    """Determine if path is a Multi-Spect file without keeping it open."""
+    if not os.path.isfile(path):
+        return False
+
+    with compression.open_file(path, 'rt') as f:
+        return read_header(f) == HEADER
 
 
 class MultiSpectParser:
 
     """Parses spectrum files from Kromek Multi-Spect."""
 
+    magic = (b'$SPEC_REM:',)
+
     def __init__(self, filename):
         """Set internal variables."""
         self._name = filename
@@ -17,15 +50,14 @@ class MultiSpectParser:
         """Determine if file came from Kromek Multi-Spect.
 
         First line should be '$SPEC_REM:' and the second should be
-        'Multi-Spect'.
+        'Multi-Spect'. The file may be compressed, see `compression`.
         """
-        # open file, saving handle so we don't need to open again in parse()
-        self._handle = open(self._name)
-        # consume and save first two lines
-        lines = [self._handle.readline().strip()]
-        lines.append(self._handle.readline().strip())
+        if not os.path.isfile(self._name):
+            return False
 
-        if lines[0] == '$SPEC_REM:' and lines[1] == 'Multi-Spect':
+        # open file, saving handle so we don't need to open again in parse()
+        self._handle = compression.open_file(self._name, 'rt')
+        if read_header(self._handle) == HEADER:
             return True
         else:
             self._handle.close()
@@ -50,65 +82,45 @@ class MultiSpectParser:
             data['title'] = settings['title']
 
         with self._handle as f:
-            while True:
-                line = f.readline()
-                # TODO: we can actually recover from `line.strip() == '$DATA:'`
-                if line == '' or line.strip() == '$DATA:':
-                    raise Exception("'$MEAS_TIM:' was not found")
-                elif line.strip() == '$MEAS_TIM:':
-                    break
-
-            time = float(f.readline().split()[0])
-
-            while True:
-                line = f.readline()
-                if line == '':
-                    raise Exception("'$DATA:' was not found")
-                elif line.strip() == '$DATA:':
-                    break
-
-            # start and end are the first and last INDEX
-            start, end = map(int, f.readline().split())
-            x = numpy.arange(start, end+1)
-            y = numpy.empty_like(x)
-            for i in range(start, end+1):
-                y[i] = int(f.readline())
-
-            y = y/time
-
-            while True:
-                line = f.readline()
-                if line == '':
-                    break
-                elif line.strip() == '$ENER_FIT:':
-                    data['labels']['x'] = 'Energy (keV)'
-                    m, c = map(float, f.readline().split())
-                    x = m*x + c
-                    break
-
-            data['labels'].setdefault('x', 'Channel')
-
-            if 'LowX' in settings:
-                indices = float(settings['LowX']) < x
-                x = x[indices]
-                y = y[indices]
-
-            if 'HighX' in settings:
-                indices = x < float(settings['HighX'])
-                x = x[indices]
-                y = y[indices]
-
-            data['axes'].append({'x': x, 'y': y})
+            spectrum = read_spectrum(f)
+
+        x = spectrum.x
+        y = spectrum.counts/spectrum.time
+        if spectrum.fit is not None:
+            data['labels']['x'] = 'Energy (keV)'
+        else:
+            data['labels']['x'] = 'Channel'
+
+        indices = window(
+            x,
+            float(settings['LowX']) if 'LowX' in settings else None,
+            float(settings['HighX']) if 'HighX' in settings else None,
+        )
+        x = x[indices]
+        y = y[indices]
+
+        data['axes'].append({'x': x, 'y': y})
 
         return data
 
+    def dependencies(self):
+        """List the files other than the spectrum which were read."""
+        return [self.settings_file()]
+
+    def settings_file(self):
+        """Name of the settings file, which may not exist.
+
+        The settings of 'a.spe.gz' are in 'a', like those of 'a.spe'.
+        """
+        return os.path.splitext(compression.strip(self._name))[0]
+
     def settings(self):
         """Parse settings file if available.
 
         Assume settings file is an INI file with the same file name as the
         spectrum file minus the file extension.
         """
-        settings_file = os.path.splitext(self._name)[0]
+        settings_file = self.settings_file()
         if os.path.exists(settings_file):
             with open(settings_file) as f:
                 config = configparser.ConfigParser()
@@ -117,3 +129,258 @@ class MultiSpectParser:
             return config['Plot']
         else:
             return {}
+
+
+class MultiSpectStackParser:
+
+    """Stacks a directory of Multi-Spect spectra into a single image.
+
+    Each spectrum becomes one row of a (time x channel) array which is
+    memory-mapped from a temporary file, so days of spectra take up very little
+    memory. Every spectrum is calibrated to the energies of the first one and
+    divided by its own measurement time.
+    """
+
+    # stacks with fewer files than this aren't worth starting processes for
+    parallel_threshold = 64
+
+    def __init__(self, filename):
+        """Set internal variables."""
+        self._name = filename
+        self._files = None
+
+    def isfiletype(self):
+        """Determine if the name is a directory or glob of Multi-Spect files."""
+        if os.path.isdir(self._name):
+            names = sorted(os.listdir(self._name))
+            paths = [os.path.join(self._name, n) for n in names]
+        else:
+            paths = sorted(glob.glob(self._name))
+            if paths == [self._name]:
+                # a single file is a spectrum, not a stack
+                return False
+
+        self._files = [p for p in paths if is_spectrum(p)]
+        return len(self._files) > 0
+
+    def dependencies(self):
+        """List the spectra and the settings file which were read."""
+        files = list(self._files or [])
+        if files:
+            files.append(MultiSpectParser(files[0]).settings_file())
+
+        return files
+
+    def parse(self):
+        """Read every spectrum, in parallel, into a memory-mapped array."""
+        if self._files is None and not self.isfiletype():
+            raise Exception('{} contains no Multi-Spect files'.format(
+                self._name
+            ))
+
+        with compression.open_file(self._files[0], 'rt') as f:
+            first = read_spectrum(f)
+        settings = MultiSpectParser(self._files[0]).settings()
+
+        x = first.x[window(
+            first.x,
+            float(settings['LowX']) if 'LowX' in settings else None,
+            float(settings['HighX']) if 'HighX' in settings else None,
+        )]
+
+        shape = (len(self._files), len(x))
+        fd, stack_file = tempfile.mkstemp(prefix='uniplot-', suffix='.stack')
+        os.close(fd)
+        try:
+            stack = numpy.memmap(
+                stack_file, dtype=numpy.float32, mode='w+', shape=shape
+            )
+
+            jobs = list(enumerate(self._files))
+            initargs = (stack_file, shape, x)
+            # daemonic processes, such as batch and server workers, can't
+            # start their own
+            daemon = multiprocessing.current_process().daemon
+            if len(jobs) < self.parallel_threshold or daemon:
+                _init_stack(*initargs)
+                dates = [_stack_spectrum(job) for job in jobs]
+            else:
+                with concurrent.futures.ProcessPoolExecutor(
+                    initializer=_init_stack, initargs=initargs
+                ) as executor:
+                    dates = list(executor.map(
+                        _stack_spectrum, jobs, chunksize=16
+                    ))
+        finally:
+            # the memory-map stays valid once the file is unlinked
+            try:
+                os.remove(stack_file)
+            except OSError:
+                pass
+
+        data = {}
+        if 'title' in settings:
+            data['title'] = settings['title']
+        data['labels'] = {
+            'x': 'Channel' if first.fit is None else 'Energy (keV)',
+        }
+
+        try:
+            times = [
+                datetime.datetime.strptime(d, '%m/%d/%Y %H:%M:%S')
+                for d in dates
+            ]
+        except (TypeError, ValueError):
+            # some spectra are missing their date so just number them
+            data['labels']['y'] = 'Spectrum'
+            y = numpy.arange(len(self._files))
+        else:
+            # file names needn't sort in the order the spectra were measured
+            order = numpy.argsort(times, kind='stable')
+            permute_rows(stack, order)
+            times = [times[i] for i in order]
+
+            data['labels']['y'] = 'Time (h)'
+            y = numpy.array([(t - times[0]).total_seconds() for t in times])
+            y = y/3600
+
+        data['axes'] = [{
+            'legend': 'Intensity ($s^{-1}$)',
+            'x': x,
+            'y': y,
+            'z': stack,
+        }]
+
+        return data
+
+
+# the stack and energies being written to by this process, see _init_stack
+_stack = None
+_energies = None
+
+
+def _init_stack(stack_file, shape, energies):
+    """Open the stack once in each process which writes to it."""
+    global _stack, _energies
+    _stack = numpy.memmap(
+        stack_file, dtype=numpy.float32, mode='r+', shape=shape
+    )
+    _energies = energies
+
+
+def _stack_spectrum(job):
+    """Write one spectrum into its row of the stack, returning its date."""
+    row, path = job
+    with compression.open_file(path, 'rt') as f:
+        spectrum = read_spectrum(f)
+
+    # calibrations differ between spectra so share the first one's energies,
+    # energies this spectrum didn't cover are left blank
+    _stack[row] = numpy.interp(
+        _energies, spectrum.x, spectrum.counts/spectrum.time,
+        left=numpy.nan, right=numpy.nan,
+    )
+    _stack.flush()
+
+    return spectrum.date
+
+
+def permute_rows(array, order):
+    """Reorder the rows of an array in place, row i becoming row order[i].
+
+    Each cycle of the permutation is followed with a copy of just one row, so
+    a memory-mapped array is never read into memory.
+    """
+    done = numpy.zeros(len(order), dtype=bool)
+    for start in range(len(order)):
+        if done[start] or order[start] == start:
+            continue
+
+        first = array[start].copy()
+        row = start
+        while order[row] != start:
+            array[row] = array[order[row]]
+            done[row] = True
+            row = order[row]
+        array[row] = first
+        done[row] = True
+
+
+Spectrum = collections.namedtuple(
+    'Spectrum', ['x', 'counts', 'time', 'fit', 'date']
+)
+
+
+def read_spectrum(f):
+    """Read the sections of a Multi-Spect file which are used for plotting.
+
+    x is calibrated to energy if the file has an '$ENER_FIT:' section, in which
+    case fit is the (gradient, intercept) of the calibration. date is None if
+    the file has no '$DATE_MEA:' section.
+    """
+    date = None
+    while True:
+        line = f.readline()
+        # TODO: we can actually recover from `line.strip() == '$DATA:'`
+        if line == '' or line.strip() == '$DATA:':
+            raise Exception("'$MEAS_TIM:' was not found")
+        elif line.strip() == '$DATE_MEA:':
+            date = f.readline().strip()
+        elif line.strip() == '$MEAS_TIM:':
+            break
+
+    time = float(f.readline().split()[0])
+
+    while True:
+        line = f.readline()
+        if line == '':
+            raise Exception("'$DATA:' was not found")
+        elif line.strip() == '$DATA:':
+            break
+
+    # start and end are the first and last INDEX
+    start, end = map(int, f.readline().split())
+    x = numpy.arange(start, end+1)
+    counts = read_counts(f, len(x))
+
+    fit = None
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        elif line.strip() == '$ENER_FIT:':
+            m, c = map(float, f.readline().split())
+            fit = (m, c)
+            x = m*x + c
+            break
+
+    return Spectrum(x, counts, time, fit, date)
+
+
+def read_counts(f, nchannels):
+    """Read the count of every channel, one per line, in one go."""
+    block = ''.join(itertools.islice(f, nchannels))
+    counts = numpy.fromstring(block, dtype=numpy.int64, sep=' ')
+    if len(counts) != nchannels:
+        raise Exception('expected {} channels but found {}'.format(
+            nchannels, len(counts)
+        ))
+
+    return counts
+
+
+def window(x, low=None, high=None):
+    """Find the slice of monotonic x which lies strictly between low and high.
+
+    A limit of None means that side is unbounded.
+    """
+    increasing = len(x) < 2 or x[0] <= x[-1]
+    ordered = x if increasing else x[::-1]
+
+    start = 0 if low is None else ordered.searchsorted(low, side='right')
+    stop = len(x) if high is None else ordered.searchsorted(high, side='left')
+
+    if increasing:
+        return slice(start, stop)
+    else:
+        return slice(len(x) - stop, len(x) - start)
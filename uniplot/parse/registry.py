@@ -0,0 +1,205 @@
+"""Finds installed parsers without importing every one of them.
+
+Parsers may declare the file extensions they handle in an `extensions`
+attribute and the bytes their files start with in a `magic` attribute. These
+are collected from the 'uniplot.parsers' entry points once and cached, so
+picking a parser is a lookup which only imports the parsers that match.
+"""
+import os
+import sys
+import json
+import os.path
+import hashlib
+import tempfile
+import warnings
+import importlib
+from .. import compression
+from ..__about__ import __version__
+
+
+GROUP = 'uniplot.parsers'
+DEFAULT_FILE = os.path.join(
+    os.path.expanduser('~'), '.uniplot', 'parsers.json'
+)
+
+
+def entry_points():
+    """List the installed parser entry points."""
+    from importlib import metadata
+
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=GROUP))
+    else:
+        # Python < 3.10 returns a dict of groups
+        return list(eps.get(GROUP, []))
+
+
+def environment_key():
+    """Fingerprint the installed distributions.
+
+    Installing, upgrading or removing a distribution changes the modification
+    time of the directory it is installed in, so this is much cheaper than
+    reading the metadata of every distribution.
+    """
+    stamps = []
+    for path in sys.path:
+        if path == '':
+            # the working directory changes far too often to be useful
+            continue
+        try:
+            stamps.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            stamps.append((path, None))
+
+    return hashlib.sha1(repr((__version__, stamps)).encode()).hexdigest()
+
+
+class ParserInfo:
+
+    """What is known about a parser without importing it."""
+
+    def __init__(self, name, module, attr, extensions=(), magic=(),
+                 error=None):
+        """Set internal variables."""
+        self.name = name
+        self.module = module
+        self.attr = attr
+        self.extensions = list(extensions)
+        self.magic = [bytes(m) for m in magic]
+        # why the parser couldn't be imported when the registry was built
+        self.error = error
+
+    @classmethod
+    def from_entry_point(cls, ep):
+        """Import the parser to find out which files it handles."""
+        module, _, attr = ep.value.partition(':')
+        attr = attr.split('[')[0].strip()
+        try:
+            parser = ep.load()
+        except Exception as e:
+            return cls(ep.name, module.strip(), attr, error=str(e))
+
+        return cls(
+            ep.name, module.strip(), attr,
+            getattr(parser, 'extensions', ()), getattr(parser, 'magic', ()),
+        )
+
+    @classmethod
+    def from_dict(cls, info):
+        """Read back a dict made by `to_dict`."""
+        info = dict(info)
+        info['magic'] = [m.encode('latin-1') for m in info['magic']]
+        return cls(**info)
+
+    def to_dict(self):
+        """Convert to a dict which can be stored as JSON."""
+        return {
+            'name': self.name,
+            'module': self.module,
+            'attr': self.attr,
+            'extensions': self.extensions,
+            'magic': [m.decode('latin-1') for m in self.magic],
+            'error': self.error,
+        }
+
+    @property
+    def declared(self):
+        """Whether the parser says which files it handles."""
+        return bool(self.extensions or self.magic)
+
+    def matches(self, extension, head):
+        """Determine if a file looks like it is handled by this parser."""
+        return extension in self.extensions or any(
+            head.startswith(m) for m in self.magic
+        )
+
+    def load(self):
+        """Import the parser class."""
+        return getattr(importlib.import_module(self.module), self.attr)
+
+
+class Registry:
+
+    """Every installed parser, cached in a JSON file between runs.
+
+    The cache is rebuilt whenever the installed distributions change.
+    """
+
+    def __init__(self, parsers):
+        """Set internal variables."""
+        self.parsers = parsers
+
+    @classmethod
+    def load(cls, filename=DEFAULT_FILE):
+        """Read the cached registry, rebuilding it if it is out of date."""
+        key = environment_key()
+        try:
+            with open(filename) as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                return cls([ParserInfo.from_dict(p) for p in cached['parsers']])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        registry = cls.build()
+        try:
+            registry.save(filename, key)
+        except OSError as e:
+            warnings.warn("parser registry could not be saved: {}".format(e))
+
+        return registry
+
+    @classmethod
+    def build(cls):
+        """Import every parser to find out which files it handles."""
+        return cls([ParserInfo.from_entry_point(ep) for ep in entry_points()])
+
+    def save(self, filename, key):
+        """Write the registry to filename atomically."""
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'key': key,
+                'parsers': [p.to_dict() for p in self.parsers],
+            }, f, indent=1)
+        os.replace(tmp, filename)
+
+    def named(self, name):
+        """List the parsers called name."""
+        return [p for p in self.parsers if p.name == name]
+
+    def candidates(self, filename):
+        """List the parsers which might handle filename, best first.
+
+        Parsers whose extensions or magic match come first, followed by those
+        which don't declare either. Parsers which declare them but don't match
+        are left out.
+        """
+        extension = os.path.splitext(compression.strip(filename))[1]
+        head = read_head(filename, max(
+            (len(m) for p in self.parsers for m in p.magic), default=0
+        ))
+
+        matched = [p for p in self.parsers if p.matches(extension, head)]
+        undeclared = [p for p in self.parsers if not p.declared]
+        return matched + undeclared
+
+
+def read_head(filename, size):
+    """Read the first size bytes of a file, nothing if it isn't a file.
+
+    Compressed files are decompressed, so magic is matched against what's
+    inside them.
+    """
+    if size == 0 or not os.path.isfile(filename):
+        return b''
+
+    try:
+        with compression.open_file(filename) as f:
+            return f.read(size)
+    except compression.ERRORS:
+        # corrupt or not really compressed, let the parsers decide
+        return b''
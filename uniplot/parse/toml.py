@@ -1,16 +1,25 @@
 """Parses TOML files."""
-import pytoml
 import os.path
 
+try:
+    # in the standard library from Python 3.11, much faster than pytoml
+    import tomllib
+except ImportError:
+    tomllib = None
+    import pytoml
+
 
 class TomlParser:
 
     """Parses TOML files for uniplot.
 
     Syntax and other information: https://github.com/toml-lang/toml
-    Parsing module information: https://github.com/avakar/pytoml
+    Parsing module information: https://docs.python.org/3/library/tomllib.html
+    or https://github.com/avakar/pytoml before Python 3.11
     """
 
+    extensions = ('.toml',)
+
     def __init__(self, filename):
         """Set internal variables."""
         self._name = filename
@@ -24,7 +33,11 @@ class TomlParser:
 
     def parse(self):
         """Parse TOML file with no error handling."""
-        with open(self._name, 'r') as f:
-            plot_data = pytoml.load(f)
+        if tomllib is None:
+            with open(self._name, 'r') as f:
+                plot_data = pytoml.load(f)
+        else:
+            with open(self._name, 'rb') as f:
+                plot_data = tomllib.load(f)
 
         return plot_data
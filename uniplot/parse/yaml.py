@@ -1,8 +1,73 @@
 """Parses YAML files."""
 import yaml
+import numpy
 import os.path
 
 
+# use libyaml's parser when PyYAML was built with it, it is several times faster
+_BaseLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# sequences of at least this many numbers are loaded as NumPy arrays
+ARRAY_THRESHOLD = 1000
+
+_INT_TAG = 'tag:yaml.org,2002:int'
+_FLOAT_TAG = 'tag:yaml.org,2002:float'
+
+
+class ArrayLoader(_BaseLoader):
+
+    """Safely loads YAML, reading long lists of numbers straight into arrays.
+
+    Constructing a Python int or float for every value of a large inline list
+    takes far longer than parsing the file, so the text of each value is given
+    to NumPy instead.
+    """
+
+    def construct_array(self, node):
+        """Construct a sequence, as an array if it is long and all numbers."""
+        values = node.value
+        if len(values) >= ARRAY_THRESHOLD:
+            tags = set(
+                v.tag if isinstance(v, yaml.ScalarNode) else None
+                for v in values
+            )
+            if tags == {_INT_TAG}:
+                array = self._to_array(values, numpy.int64)
+            elif tags <= {_INT_TAG, _FLOAT_TAG}:
+                array = self._to_array(values, float)
+            else:
+                array = None
+
+            if array is not None:
+                return array
+
+        return self.construct_sequence(node)
+
+    @staticmethod
+    def _to_array(values, dtype):
+        """Convert the text of scalar nodes, None if NumPy can't."""
+        if any(v.tag == _INT_TAG and _is_octal(v.value) for v in values):
+            # whatever the dtype NumPy would read these as decimal
+            return None
+
+        try:
+            return numpy.array([v.value for v in values], dtype=dtype)
+        except (ValueError, OverflowError):
+            # e.g. '.inf', '0x1f' or '1:30', leave them to PyYAML
+            return None
+
+
+def _is_octal(text):
+    """Determine if the text of an int is octal, as YAML 1.1 has it."""
+    digits = text.lstrip('+-')
+    return digits.startswith('0') and len(digits) > 1
+
+
+ArrayLoader.add_constructor(
+    'tag:yaml.org,2002:seq', ArrayLoader.construct_array
+)
+
+
 class YamlParser:
 
     """Parses YAML files for uniplot.
@@ -11,6 +76,8 @@ class YamlParser:
     Parsing module information: https://pypi.python.org/pypi/PyYAML/
     """
 
+    extensions = ('.yml',)
+
     def __init__(self, filename):
         """Set internal variables."""
         self._name = filename
@@ -25,7 +92,7 @@ class YamlParser:
 
     def parse(self):
         """Parse YAML file with no error handling."""
-        with open(self._name, 'r') as f:
-            plot_data = yaml.load(f.read())
+        with open(self._name, 'rb') as f:
+            plot_data = yaml.load(f, Loader=ArrayLoader)
 
         return plot_data
@@ -1,57 +1,129 @@
 """Handles the actual plotting of the file."""
+import io
 import math
 import numpy
 import os.path
 import warnings
+import threading
+import contextlib
 import matplotlib
-from matplotlib import pyplot
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from . import decimate, profile
+from .data import (
+    DataFileLoader, ExpressionReference, HistogramReference, Reference,
+)
 
 
 _LIST = (list, numpy.ndarray)
+STYLE_DIR = os.path.join(os.path.expanduser('~'), '.uniplot', 'style')
+
+# grids with at least this many subplots place at most DENSE_TICKS ticks on each
+# axis, so they are quicker to draw and don't overlap
+DENSE_GRID = 25
+DENSE_TICKS = 4
+
+# styles work by changing the global rcParams, which matplotlib reads while
+# drawing and saving as well as while plotting, so only one thread at a time
+# may use them. the lock is held from plotting until the last output is saved,
+# which serialises renders in different threads: use processes (see `batch`
+# and `shard`) to render in parallel
+_STYLE_LOCK = threading.RLock()
 
 
 class Graph:
 
     """The top level data structure, one file is one Graph."""
 
-    def __init__(self, data):
-        """Extract graph attributes."""
+    def __init__(self, data, loader=None, load=True):
+        """Extract graph attributes then load any data files.
+
+        Every data file referenced anywhere in the graph is read only once. If
+        load is False the data files aren't read until `load` is called.
+        """
+        if loader is None:
+            loader = DataFileLoader()
+        self._loader = loader
+        # the files the graph was parsed from, set by the parser
+        self.sources = []
+
         if 'plots' in data:
             plots = data['plots']
             self.title = data.get('title', '')
             self.share = data.get('share', True)
             self.style = data.get('style')
+            self.decimate = decimate.method(data.get('decimate'))
         else:  # top-level object is a (list of) plot(s)
             plots = data
             self.title = ''
             # a single plot can't share with itself
             self.share = False
             self.style = None
+            self.decimate = None
 
         if isinstance(plots, _LIST):
-            self.plots = [Plot(p) for p in plots]
+            self.plots = [Plot(p, loader) for p in plots]
         else:
-            self.plots = [Plot(plots)]
+            self.plots = [Plot(plots, loader)]
+
+        # every data file which values are read from
+        self.data_files = sorted(set(
+            ref.filename
+            for subplot in self.plots
+            for axis in subplot.axes
+            for ref in axis.references()
+        ))
+
+        if load:
+            self.load()
+
+    def prefetch(self):
+        """Start reading the data files in the background.
+
+        `plot` waits for them once the subplots have been laid out, so the
+        reads overlap with the layout.
+        """
+        self._loader.prefetch()
+
+    def load(self):
+        """Read the data files and fill in the values of every axes."""
+        with profile.stage('load'):
+            self._loader.load()
+            for subplot in self.plots:
+                for axis in subplot.axes:
+                    axis.resolve(self._loader)
+
+    @property
+    def points(self):
+        """Number of values plotted, counting each pixel of an image."""
+        return sum(
+            int(numpy.size(getattr(axis, 'z', axis.y)))
+            for subplot in self.plots
+            for axis in subplot.axes
+        )
 
     def plot(self, canvas):
         """Set attributes for the entire graph."""
         nsubs = len(self.plots)
-        # as close an approximation to square as possible without empty rows
-        nrows = round_half_up(math.sqrt(nsubs))
-        ncols = math.ceil(nsubs/nrows)
+        nrows, ncols = grid_shape(nsubs)
 
         # TODO: should this be a method?
-        mpl_axes = subplots(canvas, nrows, ncols, nsubs, self.share)
+        with profile.stage('layout', subplots=nsubs):
+            mpl_axes = subplots(canvas, nrows, ncols, nsubs, self.share)
+
+        if any(a.references() for subplot in self.plots for a in subplot.axes):
+            self.load()
 
         for (mpl_axis, subplot) in zip(mpl_axes, self.plots):
-            subplot.plot(mpl_axis)
+            subplot.plot(mpl_axis, self.decimate)
 
 
 class Plot:
 
     """One or more Plots sit within a Graph."""
 
-    def __init__(self, data):
+    def __init__(self, data, loader=None):
         """Extract plot attributes."""
         self.title = data.get('title', '')
         self.labels = data.get('labels', {'x': 'x', 'y': 'y'})
@@ -62,11 +134,11 @@ class Plot:
             axes = data
 
         if isinstance(axes, _LIST):
-            self.axes = [Axes(a) for a in axes]
+            self.axes = [Axes(a, loader) for a in axes]
         else:
-            self.axes = [Axes(axes)]
+            self.axes = [Axes(axes, loader)]
 
-    def plot(self, canvas):
+    def plot(self, canvas, decimation=None):
         """Set the attributes for each plot within the graph."""
         canvas.set_title(self.title)
 
@@ -74,73 +146,211 @@ class Plot:
         canvas.set_ylabel(self.labels['y'])
 
         for axis in self.axes:
-            axis.plot(canvas)
+            axis.plot(canvas, decimation)
+
+        # images and axes without a legend attribute have no legend entry
+        if canvas.get_legend_handles_labels()[0]:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                timed_draw(canvas.legend(loc='best'), 'legend')
+
+
+def timed_draw(artist, name):
+    """Record each time an artist is drawn as a stage called name.
+
+    Some artists do most of their work while being drawn, such as a legend
+    which only finds its best location then, so this is timed as part of
+    savefig rather than when the artist is created.
+    """
+    draw = artist.draw
 
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore')
-            canvas.legend(loc='best')
+    def timed(renderer):
+        with profile.stage(name):
+            return draw(renderer)
+
+    artist.draw = timed
 
 
 class Axes:
 
     """Axes contain the data to be plotted."""
 
-    def __init__(self, data):
-        """Extract axes attributes and data."""
+    def __init__(self, data, loader=None):
+        """Extract axes attributes and data.
+
+        If a loader is given any data files are only requested from it and
+        `resolve` must be called once it has loaded them.
+        """
         self.label = data.get('legend', '')
-        self.parse_axis_values(data, 'x')
-        self.parse_axis_values(data, 'y')
+        # error axis -> (value axis, percentage), needs values to be resolved
+        self._percentage_errors = {}
+
+        resolve = loader is None
+        if resolve:
+            loader = DataFileLoader()
+
+        if 'x' in data or not is_histogram(data.get('y')):
+            self.parse_axis_values(data, 'x', loader)
+        self.parse_axis_values(data, 'y', loader)
+        if 'x' not in data:  # a histogram against the centres of its bins
+            self.x = loader.request(self.y.centres())
+        if 'z' in data:  # an image with pixel centres given by x and y
+            self.parse_axis_values(data, 'z', loader)
+
+        if resolve:
+            self.resolve(loader)
+        else:
+            # inline values have nothing to wait for, and a graph which
+            # doesn't reference any data files is never resolved
+            self._apply_percentage_errors()
 
-    def plot(self, canvas):
-        """Plot data onto the axis."""
-        # attributes of Axes corresponds to the function arguments
-        args = vars(self)
+    def plot(self, canvas, decimation=None):
+        """Plot data onto the axis.
 
-        if 'xerr' in args or 'yerr' in args:
+        If decimation names a method in `decimate.METHODS` then line plots are
+        reduced to the resolution of the canvas before being drawn.
+        """
+        # public attributes of Axes corresponds to the function arguments
+        args = {k: v for (k, v) in vars(self).items() if not k.startswith('_')}
+
+        if 'z' in args:
+            if is_even(args['x']) and is_even(args['y']):
+                image = canvas.imshow(
+                    args['z'], extent=edges(args['x']) + edges(args['y']),
+                    origin='lower', aspect='auto', interpolation='nearest',
+                )
+            else:
+                # e.g. spectra with gaps between them, each row is drawn
+                # halfway to its neighbours
+                image = canvas.pcolormesh(
+                    cell_edges(args['x']), cell_edges(args['y']), args['z'],
+                    shading='flat',
+                )
+            if self.label:
+                canvas.figure.colorbar(image, ax=canvas, label=self.label)
+        elif 'xerr' in args or 'yerr' in args:
             canvas.errorbar(fmt='o', **args)
         else:
-            # plot doesn't support plot(x=..., y=...)
-            canvas.plot(args.pop('x'), args.pop('y'), **args)
-
-    def parse_axis_values(self, data, axis):
-        """Extract values of axis data."""
+            x, y = args.pop('x'), args.pop('y')
+            if decimation is None:
+                # plot doesn't support plot(x=..., y=...)
+                canvas.plot(x, y, **args)
+            else:
+                # an empty line picks up the next style in the cycle
+                style, = canvas.plot([], [], **args)
+                style.remove()
+                line = decimate.DecimatedLine(x, y, decimation)
+                line.update_from(style)
+                line.set_label(style.get_label())
+                canvas.add_line(line)
+                canvas.autoscale_view()
+
+    def parse_axis_values(self, data, axis, loader):
+        """Extract values of axis data.
+
+        Data in files is requested from loader and left as a reference.
+        """
         # TODO: this is reallyreallyreally ugly, split it into multiple methods
         if isinstance(data[axis], _LIST):  # hard-coded data
-            self.__dict__[axis] = numpy.array(data[axis])
-        elif isinstance(data[axis], str):  # data in 'filename:column:skiprows'
-            self.__dict__[axis] = self.load_array_from_file(data[axis])
+            self.__dict__[axis] = numpy.asarray(data[axis])
+        elif isinstance(data[axis], str):  # data in 'filename:column:...'
+            self.__dict__[axis] = loader.request(data[axis])
+        elif is_histogram(data[axis]):  # counts of the values in a file
+            self.__dict__[axis] = loader.request(
+                HistogramReference.from_spec(data[axis])
+            )
+        elif 'expression' in data[axis]:  # calculated from columns of a file
+            self.__dict__[axis] = loader.request(
+                ExpressionReference.from_spec(data[axis])
+            )
+            self.parse_errors(data, axis, loader)
         else:  # data given with `values` and `errors`
             if isinstance(data[axis]['values'], str):
-                self.__dict__[axis] = self.load_array_from_file(
-                    data[axis]['values']
-                )
+                self.__dict__[axis] = loader.request(data[axis]['values'])
             else:
-                self.__dict__[axis] = numpy.array(data[axis]['values'])
+                self.__dict__[axis] = numpy.asarray(data[axis]['values'])
+
+            self.parse_errors(data, axis, loader)
+
+    def parse_errors(self, data, axis, loader):
+        """Extract the errors of axis data, if it has any."""
+        if 'errors' not in data[axis]:
+            return
+
+        err_axis = axis + 'err'
+        errors = data[axis]['errors']
+
+        if isinstance(errors, _LIST):  # an error for each value
+            self.__dict__[err_axis] = numpy.asarray(errors)
+        elif isinstance(errors, str):  # errors in file
+            self.__dict__[err_axis] = loader.request(errors)
+        elif isinstance(errors, dict) and 'expression' in errors:
+            self.__dict__[err_axis] = loader.request(
+                ExpressionReference.from_spec(errors)
+            )
+        else:  # error given as percentage
+            self._percentage_errors[err_axis] = (axis, errors)
+
+    def references(self):
+        """List the references to data files which haven't been resolved."""
+        return [v for v in vars(self).values() if isinstance(v, Reference)]
+
+    def resolve(self, loader):
+        """Replace references to data files with the loaded arrays."""
+        for (name, value) in list(vars(self).items()):
+            if isinstance(value, Reference):
+                self.__dict__[name] = loader.get(value)
+
+        self._apply_percentage_errors()
+
+    def _apply_percentage_errors(self):
+        """Calculate the errors given as a percentage of resolved values."""
+        percentages = list(self._percentage_errors.items())
+        for (err_axis, (axis, errors)) in percentages:
+            if not isinstance(self.__dict__[axis], Reference):
+                self.__dict__[err_axis] = self.__dict__[axis] * errors
+                del self._percentage_errors[err_axis]
+
+
+def is_histogram(data):
+    """Determine if axis data asks for a histogram of a file."""
+    return isinstance(data, dict) and 'histogram' in data
+
+
+def edges(centres):
+    """Find the outer edges of a row of evenly spaced pixels."""
+    if len(centres) < 2:
+        half = 0.5
+    else:
+        half = (centres[-1] - centres[0]) / (len(centres) - 1) / 2
 
-            if 'errors' in data[axis]:
-                err_axis = axis + 'err'
-                errors = data[axis]['errors']
+    return (centres[0] - half, centres[-1] + half)
 
-                if isinstance(errors, _LIST):  # an error for each value
-                    self.__dict__[err_axis] = numpy.array(errors)
-                elif isinstance(errors, str):  # errors in file
-                    self.__dict__[err_axis] = self.load_array_from_file(errors)
-                else:  # error given as percentage
-                    self.__dict__[err_axis] = self.__dict__[axis] * errors
 
-    def load_array_from_file(self, file_info_str):
-        """Load an array from a file.
+def is_even(centres, rtol=0.01):
+    """Determine if pixel centres are evenly spaced, within rtol of a step."""
+    steps = numpy.diff(numpy.asarray(centres, dtype=float))
+    if len(steps) < 2:
+        return True
 
-        Stored as 'filename:column:skiprows'.
-        """
-        # TODO:
-        #   make filename behave relative to .hip file unless an absolute string
-        file_info = file_info_str.split(':')
-        delim = ',' if os.path.splitext(file_info[0])[1] == '.csv' else None
-        return numpy.loadtxt(
-            file_info[0], delimiter=delim, usecols=[int(file_info[1])],
-            skiprows=0 if len(file_info) < 3 else int(file_info[2])
-        )
+    step = steps.mean()
+    return bool(numpy.all(numpy.abs(steps - step) <= abs(step) * rtol))
+
+
+def cell_edges(centres):
+    """Find the edges of every cell of a row of unevenly spaced centres.
+
+    Cells meet halfway between centres, the outer ones are as wide on the
+    outside as they are on the inside.
+    """
+    centres = numpy.asarray(centres, dtype=float)
+    if len(centres) < 2:
+        return numpy.array([centres[0] - 0.5, centres[0] + 0.5])
+
+    middles = (centres[1:] + centres[:-1]) / 2
+    return numpy.concatenate([
+        [2*centres[0] - middles[0]], middles, [2*centres[-1] - middles[-1]],
+    ])
 
 
 def round_half_up(n):
@@ -158,28 +368,63 @@ def round_half_up(n):
         return fl+1
 
 
-def subplots(fig, nrows, ncols, nsubs, share):
-    """Create a list of axes with correct ticks set to visible.
+def grid_shape(nsubs):
+    """Find the (nrows, ncols) of the grid which nsubs subplots are laid on.
 
-    Mirrors matplotlib.pyplot.subplots, though not exactly, so see the source
-    code for tips.
+    The grid is as close an approximation to square as possible without empty
+    rows.
     """
+    nrows = round_half_up(math.sqrt(nsubs))
+    ncols = math.ceil(nsubs/nrows)
+    return nrows, ncols
+
+
+def subplots(fig, nrows, ncols, nsubs, share, only=None):
+    """Lay out nsubs axes on a grid of nrows by ncols, filled row by row.
+
+    If share is true the axes in each column share their x axis and those in
+    each row share their y axis, so only the bottom plot of each column and
+    the first plot of each row label their ticks. Grids with at least
+    DENSE_GRID subplots use locators which place fewer ticks, which are much
+    quicker to draw.
+
+    If only is given just the axes with those indices are created, in the
+    places and with the tick labels they have in the full grid.
+    """
+    from matplotlib.ticker import MaxNLocator
+
+    grid = fig.add_gridspec(nrows, ncols)
+    dense = nsubs >= DENSE_GRID
+    # the first axes of each column and row, which the others share with
+    columns = {}
+    rows = {}
+
     axes = []
-    for i in range(nsubs):
-        # add_subplot is 1-indexed
-        i += 1
-        axis = fig.add_subplot(nrows, ncols, i)
+    for i in (range(nsubs) if only is None else only):
+        row, column = divmod(i, ncols)
+        if share:
+            axis = fig.add_subplot(
+                grid[row, column],
+                sharex=columns.get(column), sharey=rows.get(row),
+            )
+        else:
+            axis = fig.add_subplot(grid[row, column])
         axes.append(axis)
 
-        # true if there are plots below this one (visually)
-        if share and i + ncols <= nsubs:
-            for l in axis.get_xticklabels():
-                l.set_visible(False)
-
-        # true if not the first column
-        if share and i % ncols != 1:
-            for l in axis.get_yticklabels():
-                l.set_visible(False)
+        # shared axes share their locators, so they only need setting once
+        if dense and (not share or column not in columns):
+            axis.xaxis.set_major_locator(MaxNLocator(DENSE_TICKS))
+        if dense and (not share or row not in rows):
+            axis.yaxis.set_major_locator(MaxNLocator(DENSE_TICKS))
+        columns.setdefault(column, axis)
+        rows.setdefault(row, axis)
+
+        # set_tick_params hides the labels without making the ticks, which
+        # can't be placed properly until the data is plotted anyway
+        if share and i + ncols < nsubs:  # there is a plot below this one
+            axis.xaxis.set_tick_params(labelbottom=False)
+        if share and column != 0:
+            axis.yaxis.set_tick_params(labelleft=False)
 
     return axes
 
@@ -194,23 +439,126 @@ def plotwidth(figure, nrows, ncols):
     return height * ncols
 
 
-# TODO: maybe use style as a property?
-# TODO: maybe use as context manager to avoid the if statements
-def plot_with_style(data, canvas):
-    """Set the correct style then plot the data."""
-    style_dir = os.path.join(os.path.expanduser('~'), '.uniplot', 'style')
-    user_styles = os.listdir(style_dir)
+def user_style(name):
+    """Find the file of a stylesheet in STYLE_DIR, None if there isn't one."""
+    if name is None:
+        return None
+
+    path = os.path.join(STYLE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def new_figure():
+    """Create a figure which is drawn with Agg and isn't managed by pyplot.
+
+    The figure always has the default style, even while another thread is
+    plotting in a different one. Nothing keeps a reference to the figure, so
+    it is freed as soon as the caller is finished with it.
+    """
+    with _STYLE_LOCK:
+        figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def render(data, output, figure=None, thumbnails=(), shards=None, **kwargs):
+    """Plot a loaded Graph and save it to output, without using pyplot.
+
+    data may also be the dict a Graph is made from, in which case values can be
+    given as NumPy arrays as well as lists. output is a file name or a file
+    object, or a list of them which are all saved from the one plot. kwargs are
+    passed to `Figure.savefig` so give a format when saving to a file object.
+    thumbnails is a list of (output, width) pairs, each of which is saved as a
+    PNG which is width pixels wide.
+
+    If a figure is given it is cleared and reused, which saves reallocating the
+    Agg buffer when many graphs are rendered one after another. The figure is
+    always cleared after saving so the plotted data can be freed. It is safe to
+    call from several threads as long as they don't share a figure, but the
+    renders are serialised: only one thread plots or saves at a time.
+
+    If shards is given the subplots of raster outputs and thumbnails are drawn
+    in that many processes, or one per CPU core if it is 0, see `shard`.
+    """
+    if not isinstance(data, Graph):
+        data = Graph(data)
+    outputs = output if isinstance(output, list) else [output]
+
+    if shards is not None and shards != 1:
+        from . import shard
+        outputs, thumbnails = shard.render(
+            data, outputs, thumbnails, shards, **kwargs
+        )
+        if not outputs and not thumbnails:
+            return
+
+    with _STYLE_LOCK:
+        if figure is None:
+            figure = new_figure()
+        else:
+            empty(figure)
+
+        try:
+            with style_context(data.style):
+                with profile.stage('plot') as record:
+                    data.plot(figure)
+                    # only known once the data files have been read
+                    record.update(points=data.points)
+                for output in outputs:
+                    with profile.stage('savefig', output=str(output)):
+                        figure.savefig(output, **kwargs)
+                for (output, width) in thumbnails:
+                    thumbnail_kwargs = dict(kwargs, format='png')
+                    thumbnail_kwargs['dpi'] = width / figure.get_figwidth()
+                    with profile.stage('thumbnail', output=str(output)):
+                        figure.savefig(output, **thumbnail_kwargs)
+        finally:
+            empty(figure)
+
+
+def empty(figure):
+    """Remove everything from a figure so it can be reused.
+
+    Unlike `Figure.clear` the axes aren't reset before being removed, which
+    takes longer than plotting them when there are hundreds.
+    """
+    for axis in list(figure.axes):
+        figure.delaxes(axis)
+    figure.clear()
+
+
+def render_bytes(data, format='pdf', **kwargs):
+    """Render a Graph, or the dict it is made from, to bytes in memory.
+
+    Takes the same arguments as `render`.
+    """
+    buffer = io.BytesIO()
+    render(data, buffer, format=format, **kwargs)
+    return buffer.getvalue()
+
+
+def style_context(name):
+    """Temporarily set the style called name.
+
+    Styles in STYLE_DIR take precedence over matplotlib's own, an unknown style
+    warns and uses the default.
+    """
+    style_file = user_style(name)
 
     # TODO: use plugin for styles (store them as dict then use rc=...)
     # TODO: have a way to use default regardless of data.style
-    if data.style in user_styles:
-        with matplotlib.rc_context(fname=os.path.join(style_dir, data.style)):
-            data.plot(canvas)
-    elif data.style in pyplot.style.available:
-        with pyplot.style.context(data.style):
-            data.plot(canvas)
+    if style_file is not None:
+        return matplotlib.rc_context(fname=style_file)
+    elif name in matplotlib.style.available:
+        return matplotlib.style.context(name)
     else:
-        if data.style is not None:
-            m = "style '{}' not found, using default.".format(data.style)
+        if name is not None:
+            m = "style '{}' not found, using default.".format(name)
             warnings.warn(m)
+        return contextlib.nullcontext()
+
+
+def plot_with_style(data, canvas):
+    """Set the correct style then plot the data."""
+    with _STYLE_LOCK, style_context(data.style):
         data.plot(canvas)
@@ -0,0 +1,202 @@
+"""Records how long each stage of rendering a file takes.
+
+Code marks out a stage with `stage`, which does nothing unless a Profiler is
+recording in the current thread:
+
+    with profile.stage('savefig', output=name) as record:
+        ...
+        record['bytes'] = size
+
+Each stage records its wall time, the peak resident memory of the process and,
+if asked for, the peak memory traced by tracemalloc, along with anything the
+code adds to the record. Stages may be nested.
+"""
+import os
+import sys
+import json
+import time
+import os.path
+import hashlib
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+_local = threading.local()
+
+
+def max_rss():
+    """Peak resident memory of this process in bytes, None if unknown."""
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextlib.contextmanager
+def stage(name, **info):
+    """Time a stage of the current run, yielding a dict to add info to."""
+    run = getattr(_local, 'run', None)
+    if run is None:
+        yield {}
+        return
+
+    record = dict(name=name, depth=len(run.stack), **info)
+    run.records.append(record)
+    run.enter(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        run.exit(record)
+
+
+def record(name, seconds, **info):
+    """Add a stage which was timed elsewhere, such as in another thread."""
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run.records.append(dict(
+            name=name, depth=len(run.stack), seconds=seconds,
+            max_rss=max_rss(), **info
+        ))
+
+
+class Run:
+
+    """The stages recorded while rendering one input."""
+
+    def __init__(self, trace_memory=False):
+        """Set internal variables."""
+        self.trace_memory = trace_memory
+        self.records = []
+        self.stack = []
+
+    def enter(self, record):
+        """Start recording a stage."""
+        if self.trace_memory:
+            import tracemalloc
+
+            # the peak is reset for each stage, so save the parent's first
+            if self.stack:
+                parent = self.stack[-1]
+                parent['traced_peak'] = max(
+                    parent.get('traced_peak', 0),
+                    tracemalloc.get_traced_memory()[1],
+                )
+            tracemalloc.reset_peak()
+
+        self.stack.append(record)
+
+    def exit(self, record):
+        """Finish recording a stage."""
+        self.stack.pop()
+        record['max_rss'] = max_rss()
+
+        if self.trace_memory:
+            import tracemalloc
+
+            record['traced_peak'] = max(
+                record.get('traced_peak', 0),
+                tracemalloc.get_traced_memory()[1],
+            )
+            if self.stack:
+                parent = self.stack[-1]
+                parent['traced_peak'] = max(
+                    parent.get('traced_peak', 0), record['traced_peak']
+                )
+
+
+def dump_name(input_file):
+    """Name the cProfile dump of an input, '<input>-<hash>.prof'.
+
+    The hash is of the input's absolute path, so inputs with the same name in
+    different directories, as in a batch, don't overwrite each other's dumps.
+    """
+    path = os.path.abspath(input_file)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+    return '{}-{}.prof'.format(os.path.basename(input_file), digest)
+
+
+class Profiler:
+
+    """Profiles each input file that is rendered.
+
+    Each run is summarised as a dict which can be stored as JSON. The summary
+    is appended, as a single line of JSON, to the file called output ('-' is
+    stderr) and passed to callback. trace_memory records peak memory with
+    tracemalloc, which is accurate but slows everything down. If a
+    cprofile_dir is given a cProfile dump of each run is saved in it, see
+    `dump_name`.
+    """
+
+    def __init__(
+        self, output=None, trace_memory=False, cprofile_dir=None,
+        callback=None,
+    ):
+        """Set internal variables."""
+        self.output = output
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.callback = callback
+
+    @contextlib.contextmanager
+    def profile(self, input_file):
+        """Record every stage in this thread until the block is left."""
+        if getattr(_local, 'run', None) is not None:
+            # already being profiled further up
+            yield
+            return
+
+        run = _local.run = Run(self.trace_memory)
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.cprofile_dir is not None:
+            import cProfile
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            with stage('total'):
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+            _local.run = None
+            if self.cprofile_dir is not None:
+                cprofiler.disable()
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                cprofiler.dump_stats(os.path.join(
+                    self.cprofile_dir, dump_name(input_file)
+                ))
+            if self.trace_memory:
+                tracemalloc.stop()
+
+            self.report({
+                'input': input_file,
+                'pid': os.getpid(),
+                'started': started,
+                'seconds': seconds,
+                'stages': run.records,
+            })
+
+    def report(self, summary):
+        """Save the summary of a run and pass it to the callback."""
+        if self.output == '-':
+            print(json.dumps(summary), file=sys.stderr)
+        elif self.output is not None:
+            # a single write so lines from several processes don't interleave
+            with open(self.output, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+
+        if self.callback is not None:
+            self.callback(summary)
@@ -0,0 +1,307 @@
+"""Renders files in a long-running server so each plot skips start-up.
+
+The server listens on a Unix socket and shares jobs between a pool of warm
+worker processes. Clients write one JSON request per line and read one JSON
+response per line, in the order the jobs finish. A request is either
+
+    {"id": ..., "cwd": ..., "args": {...}, "input": ..., "output": ...}
+
+which renders a plot file as the command-line would, with "args" being the
+parsed command-line arguments, or
+
+    {"id": ..., "cwd": ..., "args": {...}, "spec": {...}, "format": "png"}
+
+which renders a plot given inline and returns the image base64 encoded in the
+"data" of the response. The request {"metrics": true} returns statistics about
+the server instead.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import signal
+import socket
+import os.path
+import threading
+import contextlib
+import collections
+import socketserver
+
+
+DEFAULT_SOCKET = os.path.join(
+    os.path.expanduser('~'), '.uniplot', 'serve.sock'
+)
+# number of recent jobs that latency percentiles are calculated from
+LATENCY_WINDOW = 1000
+# seconds a job may run for before it is stopped and answered with an error,
+# not counting the time it waits for a worker
+JOB_TIMEOUT = 600
+
+
+class JobTimeout(BaseException):
+
+    """Raised in a worker when a job has run for longer than JOB_TIMEOUT.
+
+    Like KeyboardInterrupt it isn't an Exception, so it isn't caught by code
+    which tries something else on failure, such as guessing the parser.
+    """
+
+
+def serve_job(request):
+    """Render one request in a worker, returning the response."""
+    from . import batch
+    from .cli import render_options
+
+    response = {'id': request.get('id')}
+    start = time.perf_counter()
+    try:
+        with time_limit(JOB_TIMEOUT):
+            os.chdir(request['cwd'])
+            options = render_options(request['args'])
+            if 'spec' in request:
+                response['data'] = base64.b64encode(render_spec(
+                    request['spec'], request['format'], **options
+                )).decode('ascii')
+                response['error'] = None
+            else:
+                (_, output, error, _, rendered) = batch.render_job(
+                    (request['input'], request.get('output'), options)
+                )
+                response.update(
+                    output=output, error=error, rendered=rendered
+                )
+    except (Exception, SystemExit, JobTimeout) as e:
+        response['error'] = '{}: {}'.format(e.__class__.__name__, e)
+
+    response['seconds'] = time.perf_counter() - start
+    return response
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """Raise JobTimeout if the block runs for longer than seconds.
+
+    Only the main thread of a process can be interrupted, which is where pool
+    workers run their jobs, so elsewhere there is no limit.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise JobTimeout('ran for longer than {}s'.format(seconds))
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def render_spec(spec, format, parser='', style=None, data_cache=None,
+                decimation=None, manifest=None, thumbnails=(), profiler=None,
+                io_threads=None, shards=None):
+    """Render a plot given as a dict, taking the options of `render_file`.
+
+    Thumbnails aren't returned, so they are ignored.
+    """
+    from .data import DataFileLoader
+    from .plot import Graph, render_bytes
+
+    if profiler is not None:
+        with profiler.profile('<spec>'):
+            return render_spec(
+                spec, format, parser, style, data_cache, decimation,
+                io_threads=io_threads, shards=shards,
+            )
+
+    graph = Graph(spec, DataFileLoader(data_cache, io_threads))
+    if graph.style is None:
+        graph.style = style
+    if graph.decimate is None:
+        graph.decimate = decimation
+
+    return render_bytes(graph, format=format, shards=shards)
+
+
+class Metrics:
+
+    """Counts jobs and how long they took, safe to update from any thread."""
+
+    def __init__(self):
+        """Set internal variables."""
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # seconds from receiving each recent job to sending its response
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def submit(self):
+        """Record that a job has been queued."""
+        with self._lock:
+            self.submitted += 1
+
+    def complete(self, seconds, failed):
+        """Record that a job has finished."""
+        with self._lock:
+            self.completed += 1
+            self.failed += bool(failed)
+            self.latencies.append(seconds)
+
+    def snapshot(self):
+        """Summarise the metrics as a dict."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            snapshot = {
+                'uptime': time.time() - self.started,
+                'queue_depth': self.submitted - self.completed,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+        for (name, fraction) in (('p50', 0.5), ('p95', 0.95), ('max', 1)):
+            if latencies:
+                index = min(int(fraction * len(latencies)), len(latencies) - 1)
+                snapshot['latency_' + name] = latencies[index]
+            else:
+                snapshot['latency_' + name] = None
+
+        return snapshot
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    """Handles one client connection.
+
+    Every request is queued as soon as it is read, so a client can send many
+    jobs at once, and each response is written as soon as its job finishes.
+    """
+
+    def handle(self):
+        """Queue each request then wait for them all to finish.
+
+        Jobs which run for too long are stopped by their worker, see
+        `time_limit`, so every job is answered.
+        """
+        self._write_lock = threading.Lock()
+        pending = []
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                self.respond({'error': 'invalid request: {}'.format(e)})
+                continue
+
+            if request.get('metrics'):
+                self.respond(self.server.metrics.snapshot())
+                continue
+
+            self.server.metrics.submit()
+            received = time.perf_counter()
+            pending.append(self.server.pool.apply_async(
+                serve_job, (request,),
+                callback=lambda r, t=received: self.finish_job(r, t),
+                error_callback=lambda e, t=received, i=request.get('id'):
+                    self.finish_job({'id': i, 'error': repr(e)}, t),
+            ))
+
+        for result in pending:
+            result.wait()
+
+    def finish_job(self, response, received):
+        """Send the response of a job and record it in the metrics.
+
+        Called from the pool's result thread, which must never raise.
+        """
+        self.server.metrics.complete(
+            time.perf_counter() - received, response.get('error')
+        )
+        try:
+            self.respond(response)
+        except OSError:
+            # the client has gone away
+            pass
+
+    def respond(self, response):
+        """Write one response line."""
+        line = json.dumps(response).encode('utf-8') + b'\n'
+        with self._write_lock:
+            self.wfile.write(line)
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Accepts connections on a Unix socket, each in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        """Bind to path and share jobs between the processes of pool."""
+        self.pool = pool
+        self.metrics = Metrics()
+        super().__init__(path, RequestHandler)
+
+
+def serve(path=DEFAULT_SOCKET, processes=None, file=sys.stderr):
+    """Run the server until interrupted."""
+    import multiprocessing
+    from . import batch
+
+    if connect(path) is not None:
+        raise Exception('a server is already listening on {}'.format(path))
+    elif os.path.exists(path):
+        # left behind by a server which didn't shut down cleanly
+        os.remove(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with multiprocessing.Pool(processes, initializer=batch.warm_up) as pool:
+        server = Server(path, pool)
+        print('serving on {}, press Ctrl-C to stop'.format(path), file=file)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            server.server_close()
+            os.remove(path)
+
+
+def connect(path=DEFAULT_SOCKET):
+    """Connect to a running server, None if there isn't one."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+
+def request(sock, requests):
+    """Send every request then yield each response as it arrives.
+
+    Each request is given the current directory and an id unless it has one,
+    responses arrive in the order the jobs finish.
+    """
+    cwd = os.getcwd()
+    with sock, sock.makefile('rwb') as f:
+        for (i, r) in enumerate(requests):
+            r = dict({'id': i, 'cwd': cwd}, **r)
+            f.write(json.dumps(r).encode('utf-8') + b'\n')
+        f.flush()
+        sock.shutdown(socket.SHUT_WR)
+
+        for line in f:
+            yield json.loads(line.decode('utf-8'))
@@ -0,0 +1,350 @@
+"""Renders the subplots of one large Graph in several processes.
+
+Only raster images can be split up. Each worker lays out the whole grid but
+only creates and plots its own share of the subplots, draws them onto a
+transparent canvas the size of the final image and sends back the part which
+was drawn on. The tiles are then composited, in order, onto the figure's
+background.
+
+Axes which are shared in a normal render share their limits across every
+process: the limits of the data in each subplot are worked out up front and
+each worker widens the data limits of its axes to cover their whole row or
+column before autoscaling, which is what matplotlib does for shared axes. The
+first axes of each row and column are laid out, though not drawn, by every
+process which needs them, since they own the tick locators of the others.
+"""
+import os.path
+import numpy
+import matplotlib
+import matplotlib.colors
+import multiprocessing
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from . import plot, profile
+
+
+# formats which are drawn as pixels, so can be made from tiles
+RASTER_FORMATS = ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp')
+
+
+def output_format(output, kwargs):
+    """The format output will be saved in, None if it can't be known."""
+    if 'format' in kwargs:
+        return kwargs['format']
+    elif isinstance(output, str):
+        ext = os.path.splitext(output)[1].lstrip('.').lower()
+        return ext or matplotlib.rcParams['savefig.format']
+    else:
+        return None
+
+
+def can_shard(kwargs):
+    """Determine if savefig's keyword arguments can be used with tiles."""
+    if set(kwargs) - {'format', 'dpi'}:
+        # e.g. bbox_inches changes the size of the image after drawing
+        return False
+
+    # daemonic processes, such as batch workers, can't start their own
+    return not multiprocessing.current_process().daemon
+
+
+def render(graph, outputs, thumbnails=(), shards=0, **kwargs):
+    """Save the raster outputs and thumbnails of a Graph from tiles.
+
+    Arguments are those of `plot.render`, with shards being the number of
+    processes to use, one per CPU core if it is 0. Returns the (outputs,
+    thumbnails) which can't be made from tiles, to be rendered normally.
+    """
+    if not graph.plots or not can_shard(kwargs):
+        return outputs, thumbnails
+
+    raster = [
+        output_format(o, kwargs) in RASTER_FORMATS for o in outputs
+    ]
+    if not any(raster) and not thumbnails:
+        return outputs, thumbnails
+
+    with plot._STYLE_LOCK:
+        # as in `plot.render` the figure has the default style, savefig's
+        # settings come from the graph's
+        figure = plot.new_figure()
+        size = tuple(figure.get_size_inches())
+        with plot.style_context(graph.style):
+            dpi = kwargs.get('dpi', matplotlib.rcParams['savefig.dpi'])
+            if dpi == 'figure':
+                dpi = figure.dpi
+            facecolor = matplotlib.rcParams['savefig.facecolor']
+            if facecolor == 'auto':
+                facecolor = figure.get_facecolor()
+            background = numpy.array(matplotlib.colors.to_rgba(facecolor))
+            background = numpy.round(background * 255)
+
+    if any(a.references() for subplot in graph.plots for a in subplot.axes):
+        graph.load()
+
+    # every image needed is drawn from the same tiles at its own resolution
+    dpis = [dpi] if any(raster) else []
+    dpis.extend(width / size[0] for (_, width) in thumbnails)
+    images = draw(graph, size, dpis, background, shards)
+
+    for (output, is_raster) in zip(outputs, raster):
+        if is_raster:
+            with profile.stage('savefig', output=str(output)):
+                save(images[0], output, output_format(output, kwargs), dpi)
+    for ((output, width), image) in zip(thumbnails, images[-len(thumbnails):]):
+        with profile.stage('thumbnail', output=str(output)):
+            save(image, output, 'png', width / size[0])
+
+    remaining = [o for (o, r) in zip(outputs, raster) if not r]
+    return remaining, ()
+
+
+def draw(graph, size, dpis, background, shards=0):
+    """Draw the graph at each of dpis, returning an RGBA array for each."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    nsubs = len(graph.plots)
+    nrows, ncols = plot.grid_shape(nsubs)
+    limits = shared_limits(graph, ncols) if graph.share else None
+
+    workers = shards or os.cpu_count() or 1
+    # contiguous subplots draw onto the same part of the image
+    groups = numpy.array_split(numpy.arange(nsubs), min(workers, nsubs))
+    jobs = [
+        (
+            [graph.plots[i] for i in group], [int(i) for i in group], nsubs,
+            graph.share, graph.decimate, graph.style, size, dpis,
+            None if limits is None else [limits[i] for i in group],
+        )
+        for group in groups if len(group)
+    ]
+
+    images = None
+    with profile.stage('plot', points=graph.points, shards=len(jobs)):
+        with ProcessPoolExecutor(len(jobs)) as executor:
+            for tiles in executor.map(draw_tiles, jobs):
+                if images is None:
+                    images = [
+                        numpy.full(shape + (4,), background, numpy.uint8)
+                        for (shape, _) in tiles
+                    ]
+                for (image, (_, tile)) in zip(images, tiles):
+                    composite(image, tile)
+
+    return images
+
+
+def draw_tiles(job):
+    """Draw a group of subplots at each dpi, returning a tile for each.
+
+    Each tile is the (height, width) of the whole image along with (top, left,
+    pixels), where pixels is the part of the RGBA image which was drawn on.
+    """
+    plots, indices, nsubs, share, decimation, style, size, dpis, limits = job
+    nrows, ncols = plot.grid_shape(nsubs)
+
+    # the figure has the default style, as in `plot.new_figure`
+    figure = Figure(figsize=size)
+    canvas = FigureCanvasAgg(figure)
+    figure.patch.set_visible(False)
+
+    with plot.style_context(style):
+        # the first axes of each column and row own the tick locators which
+        # the others share, so they are laid out even if they aren't drawn
+        leaders = {i % ncols for i in indices}
+        leaders |= {i - i % ncols for i in indices}
+        laid_out = sorted(set(indices) | leaders) if share else indices
+        mpl_axes = dict(zip(laid_out, plot.subplots(
+            figure, nrows, ncols, nsubs, share, laid_out
+        )))
+        for i in set(laid_out) - set(indices):
+            mpl_axes[i].set_visible(False)
+
+        mpl_axes = [mpl_axes[i] for i in indices]
+        for (mpl_axis, subplot) in zip(mpl_axes, plots):
+            subplot.plot(mpl_axis, decimation)
+
+        if limits is not None:
+            for (mpl_axis, (x, y)) in zip(mpl_axes, limits):
+                share_limits(mpl_axis, x, y)
+
+        tiles = []
+        for dpi in dpis:
+            figure.set_dpi(dpi)
+            canvas.draw()
+            pixels = numpy.asarray(canvas.buffer_rgba())
+            tiles.append((pixels.shape[:2], crop(pixels)))
+
+    return tiles
+
+
+def share_limits(mpl_axis, x, y):
+    """Set the limits of an axes as though it shares its whole column and row.
+
+    Matplotlib autoscales shared axes to the union of their data limits and
+    stops margins at the sticky edges of any of their data, so widening the
+    data limits and adding the sticky edges of the axes which are drawn in
+    other processes gives each process the same limits.
+    """
+    from matplotlib.lines import Line2D
+
+    (xlim, xsticky, xfixed), (ylim, ysticky, yfixed) = x, y
+
+    # an empty line adds nothing but the sticky edges
+    line = Line2D([], [], visible=False)
+    line.sticky_edges.x.extend(xsticky)
+    line.sticky_edges.y.extend(ysticky)
+    mpl_axis.add_line(line)
+
+    if xlim is not None:
+        mpl_axis.dataLim.update_from_data_x(numpy.array(xlim), ignore=False)
+    if ylim is not None:
+        mpl_axis.dataLim.update_from_data_y(numpy.array(ylim), ignore=False)
+    mpl_axis.autoscale_view()
+
+    if xfixed:
+        mpl_axis.set_xlim(xlim, auto=None)
+    if yfixed:
+        mpl_axis.set_ylim(ylim, auto=None)
+
+
+def crop(pixels):
+    """Cut a transparent image down to the part which was drawn on."""
+    drawn = pixels[..., 3] > 0
+    rows = numpy.flatnonzero(drawn.any(axis=1))
+    columns = numpy.flatnonzero(drawn.any(axis=0))
+    if not len(rows):
+        return (0, 0, numpy.zeros((0, 0, 4), numpy.uint8))
+
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = columns[0], columns[-1] + 1
+    return (top, left, pixels[top:bottom, left:right].copy())
+
+
+def composite(image, tile):
+    """Draw an RGBA tile over part of an RGBA image in place.
+
+    Only the part under the tile is converted to floats, so the whole image
+    is never more than four bytes a pixel.
+    """
+    top, left, pixels = tile
+    region = image[top:top + pixels.shape[0], left:left + pixels.shape[1]]
+    over = pixels / numpy.float32(255)
+    under = region / numpy.float32(255)
+
+    # Agg's pixels aren't premultiplied by their alpha
+    alpha = over[..., 3:]
+    beneath = under[..., 3:] * (1 - alpha)
+    total = alpha + beneath
+    colour = over[..., :3] * alpha + under[..., :3] * beneath
+    numpy.divide(colour, total, out=colour, where=total > 0)
+
+    region[..., :3] = numpy.round(colour * 255)
+    region[..., 3:] = numpy.round(total * 255)
+
+
+def shared_limits(graph, ncols):
+    """Find the limits shared by the column and row of each subplot.
+
+    Returns an (x, y) pair for each subplot, each of which is the (low, high)
+    limits of the data, None if there is none, a list of sticky edges past
+    which autoscaling adds no margin, such as the edges of images, and whether
+    the limits are fixed rather than autoscaled.
+    """
+    limits = [data_limits(subplot) for subplot in graph.plots]
+
+    def union(extents):
+        values = [v for (vs, _, _) in extents for v in vs]
+        sticky = [v for (_, vs, _) in extents for v in vs]
+        # an image sets the limits of every axes it shares with, which sticks
+        # if it is the last thing plotted on them
+        fixed = extents[-1][2]
+        if fixed is not None:
+            return (fixed, sticky, True)
+        elif not values:
+            return (None, sticky, False)
+        else:
+            return ((min(values), max(values)), sticky, False)
+
+    columns = [
+        union([x for (x, _) in limits[c::ncols]]) for c in range(ncols)
+    ]
+    rows = [
+        union([y for (_, y) in limits[r:r + ncols]])
+        for r in range(0, len(limits), ncols)
+    ]
+
+    return [
+        (columns[i % ncols], rows[i // ncols]) for i in range(len(limits))
+    ]
+
+
+def data_limits(subplot):
+    """Find the data limits of a Plot, as autoscaling sees them.
+
+    Returns an (x, y) pair, each of which is a list of the lowest and highest
+    values of each series, a list of sticky edges and the edges of the image
+    if one which sets the limits was plotted last, otherwise None.
+    """
+    x = ([], [], None)
+    y = ([], [], None)
+    for axis in subplot.axes:
+        if hasattr(axis, 'z'):
+            # images are drawn up to their edges, without a margin, and only
+            # those drawn by imshow set the limits
+            fixed = plot.is_even(axis.x) and plot.is_even(axis.y)
+            x = add_image(x, image_edges(axis.x, fixed), fixed)
+            y = add_image(y, image_edges(axis.y, fixed), fixed)
+        else:
+            x[0].extend(finite_range(axis.x, getattr(axis, 'xerr', None)))
+            y[0].extend(finite_range(axis.y, getattr(axis, 'yerr', None)))
+            x = x[:2] + (None,)
+            y = y[:2] + (None,)
+
+    return (x, y)
+
+
+def image_edges(centres, even):
+    """The outer edges of an image's pixels, as `plot.Axes` draws them."""
+    if even:
+        return plot.edges(centres)
+
+    edges = plot.cell_edges(centres)
+    return (float(edges[0]), float(edges[-1]))
+
+
+def add_image(extent, edges, fixed):
+    """Add the edges of an image to the (values, sticky, image) of an axis.
+
+    image is only kept if the image sets the limits of its axes.
+    """
+    values, sticky, _ = extent
+    values.extend(edges)
+    sticky.extend(edges)
+    return (values, sticky, edges if fixed else None)
+
+
+def finite_range(values, errors=None):
+    """The lowest and highest finite values, including any error bars.
+
+    Returns an empty list if there are no finite values.
+    """
+    values = numpy.asarray(values, dtype=float)
+    if errors is not None:
+        # errors are either symmetric or a row of lower then one of upper
+        errors = numpy.asarray(errors, dtype=float)
+        lower, upper = (errors, errors) if errors.ndim < 2 else errors
+        values = numpy.concatenate([values, values - lower, values + upper])
+
+    values = values[numpy.isfinite(values)]
+    if not len(values):
+        return []
+
+    return [float(values.min()), float(values.max())]
+
+
+def save(image, output, format, dpi):
+    """Save an RGBA array as an image file."""
+    import matplotlib.image
+
+    matplotlib.image.imsave(output, image, format=format, dpi=dpi)
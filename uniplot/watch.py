@@ -0,0 +1,137 @@
+"""Re-renders a file whenever it or anything it depends on changes."""
+import os
+import sys
+import time
+from .data import DataFileLoader, ExpressionReference
+
+
+# seconds between checks for changed files
+POLL_INTERVAL = 0.2
+
+
+def stamp(path):
+    """Identify the current version of a file, None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    else:
+        return (stat.st_size, stat.st_mtime_ns)
+
+
+class Watcher:
+
+    """Renders one input file, keeping loaded data files between renders.
+
+    Data files are only read again once they change, so editing just the input
+    file redraws using the arrays which are already in memory.
+    """
+
+    def __init__(
+        self, input_file, output_file=None, parser='', style=None,
+        data_cache=None, decimation=None, thumbnails=(), profiler=None,
+        io_threads=None, shards=None,
+    ):
+        """Set internal variables.
+
+        output_file, thumbnails, profiler, io_threads and shards are as in
+        `cli.render_file`.
+        """
+        from .cli import default_output, thumbnail_name
+
+        self.input_file = input_file
+        self.output_file = output_file or default_output(input_file)
+        first = self.output_file
+        if isinstance(first, list):
+            first = first[0]
+        self.thumbnails = [(thumbnail_name(first, w), w) for w in thumbnails]
+        self.profiler = profiler
+        self.parser = parser
+        self.style = style
+        self.decimation = decimation
+        self.shards = shards
+        self.loader = DataFileLoader(data_cache, io_threads)
+        # maps each watched file to its stamp when it was last rendered
+        self.stamps = {input_file: None}
+        self._data_files = set()
+
+    def changed(self):
+        """List the watched files which have changed since the last render."""
+        return [p for (p, s) in self.stamps.items() if stamp(p) != s]
+
+    def render(self, changed=()):
+        """Render the input file, reading only the data files in changed."""
+        if self.profiler is not None:
+            with self.profiler.profile(self.input_file):
+                return self._render(changed)
+        else:
+            return self._render(changed)
+
+    def _render(self, changed):
+        from .cli import read_graph, save_graph
+
+        # take the stamps first so a change during the render isn't missed
+        stamps = {p: stamp(p) for p in self.stamps}
+        self.loader.forget(self._data_files.intersection(changed))
+
+        try:
+            graph = read_graph(
+                self.input_file, self.parser, self.loader, self.style,
+                self.decimation,
+            )
+            watched = set(graph.sources) | set(graph.data_files)
+            # free the data of files and expressions which are no longer used
+            self.loader.forget(self._data_files - set(graph.data_files))
+            self.loader.forget_expressions(
+                ref
+                for subplot in graph.plots
+                for axis in subplot.axes
+                for ref in axis.references()
+                if isinstance(ref, ExpressionReference)
+            )
+            self._data_files = set(graph.data_files)
+
+            graph.prefetch()
+            save_graph(graph, self.output_file, self.thumbnails, self.shards)
+        except BaseException:
+            # keep watching the same files and try again once one changes
+            self.stamps = stamps
+            raise
+
+        self.stamps = {
+            p: stamps[p] if p in stamps else stamp(p) for p in watched
+        }
+
+
+def watch(input_file, output_file=None, file=sys.stderr, **options):
+    """Render input_file every time it changes, until interrupted.
+
+    options are the same as those of `cli.render_file`. Errors are printed and
+    the file is rendered again once it next changes.
+    """
+    watcher = Watcher(input_file, output_file, **options)
+    print('watching {}, press Ctrl-C to stop'.format(input_file), file=file)
+
+    try:
+        while True:
+            changed = watcher.changed()
+            if not changed:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            start = time.perf_counter()
+            try:
+                watcher.render(changed)
+            except (Exception, SystemExit) as e:
+                print('{}: {}: {}'.format(
+                    input_file, e.__class__.__name__, e
+                ), file=file)
+            else:
+                outputs = watcher.output_file
+                if isinstance(outputs, list):
+                    outputs = ', '.join(outputs)
+                print('rendered {} in {:.2f}s'.format(
+                    outputs, time.perf_counter() - start
+                ), file=file)
+    except KeyboardInterrupt:
+        return 0